@@ -0,0 +1,1260 @@
+import argparse
+import asyncio
+import contextlib
+import csv
+import hashlib
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import psycopg2
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+
+
+def carregar_modulo(nome, arquivo):
+    # Os scripts tp1_3.x têm ponto no nome, então são carregados pelo caminho
+    spec = importlib.util.spec_from_file_location(nome, os.path.join(PASTA, arquivo))
+    modulo = importlib.util.module_from_spec(spec)
+    # Registrado em sys.modules para que as funções possam ir para outros processos
+    sys.modules[nome] = modulo
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+carga = carregar_modulo("carga", "tp1_3.2.py")
+painel = carregar_modulo("painel", "tp1_3.3.py")
+
+
+def fatiar(origem, n_produtos, destino):
+    # Copia o cabeçalho e os n_produtos primeiros registros de origem para destino
+    n = 0
+    with open(origem, "r", encoding="utf8") as entrada, open(destino, "w", encoding="utf8") as saida:
+        for linha in entrada:
+            if linha.startswith("Id:"):
+                n += 1
+                if n > n_produtos:
+                    break
+            saida.write(linha)
+    return min(n, n_produtos)
+
+
+# Gerador de um amazon-meta.txt sintético, no mesmo formato do arquivo real: produtos
+# descontinuados só com Id e ASIN, caminhos de categoria, similares (alguns fora do
+# arquivo) e linhas de avaliação com clientes repetidos em proporção de lei de potência
+GRUPOS = (("Book", "Books", 283155, 0.72), ("Music", "Music", 5174, 0.19),
+          ("DVD", "DVD", 130, 0.05), ("Video", "Video", 139452, 0.04))
+PALAVRAS = ("Patterns", "Preaching", "Sermon", "Sampler", "Candida", "Cooking", "Jazz", "Greatest",
+            "Hits", "History", "Guide", "Complete", "Edition", "Live", "Collection", "Science",
+            "Fiction", "Children", "Garden", "Travel", "Música", "Coração", "Ação", "Éditions")
+
+
+def _arvore_sintetica(aleatorio, profundidade, proximo_id):
+    # {"Nome[id]": subárvore} com 2 a 4 filhos por nível
+    if profundidade == 0:
+        return {}, proximo_id
+    filhos = {}
+    for _ in range(aleatorio.randint(2, 4)):
+        nome = f"{aleatorio.choice(PALAVRAS)} & {aleatorio.choice(PALAVRAS)}[{proximo_id}]"
+        proximo_id += 1
+        filhos[nome], proximo_id = _arvore_sintetica(aleatorio, profundidade - 1, proximo_id)
+    return filhos, proximo_id
+
+
+def _caminho_sintetico(aleatorio, raiz, arvore):
+    caminho = [raiz]
+    while arvore and (len(caminho) < 2 or aleatorio.random() < 0.8):
+        nome = aleatorio.choice(list(arvore))
+        caminho.append(nome)
+        arvore = arvore[nome]
+    return "|" + "|".join(caminho)
+
+
+def _asin_sintetico(aleatorio):
+    if aleatorio.random() < 0.7:
+        return "".join(aleatorio.choice("0123456789") for _ in range(9)) + aleatorio.choice("0123456789X")
+    return "B" + "".join(aleatorio.choice("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(9))
+
+
+def gerar_amostra(destino, n_produtos, semente=1, descontinuados=0.05):
+    aleatorio = random.Random(semente)
+    asins = list(dict.fromkeys(_asin_sintetico(aleatorio) for _ in range(int(n_produtos * 1.1))))[:n_produtos]
+    # ~3% dos similares apontam para ASINs que não estão no arquivo
+    fora = [_asin_sintetico(aleatorio) for _ in range(max(1, n_produtos // 30))]
+    # Ids acima dos das raízes, para não repetir nenhum
+    proximo_id = 300000
+    arvores = {}
+    for grupo, _, _, _ in GRUPOS:
+        arvores[grupo], proximo_id = _arvore_sintetica(aleatorio, 5, proximo_id)
+    grupos = [grupo for grupo, _, _, _ in GRUPOS]
+    pesos = [peso for _, _, _, peso in GRUPOS]
+    raizes = {grupo: f"{raiz}[{raiz_id}]" for grupo, raiz, raiz_id, _ in GRUPOS}
+    n_clientes = max(10, n_produtos)
+
+    with open(destino, "w", encoding="utf8") as f:
+        f.write(f"# Full information about all the Amazon products\nTotal items: {n_produtos}\n\n")
+        for product_id, asin in enumerate(asins):
+            f.write(f"Id:   {product_id}\nASIN: {asin}\n")
+            if aleatorio.random() < descontinuados:
+                f.write("  discontinued product\n\n")
+                continue
+            grupo = aleatorio.choices(grupos, pesos)[0]
+            titulo = " ".join(aleatorio.choice(PALAVRAS) for _ in range(aleatorio.randint(1, 8)))
+            f.write(f"  title: {titulo}\n  group: {grupo}\n  salesrank: {aleatorio.randint(0, 3800000)}\n")
+
+            similares = [aleatorio.choice(fora) if aleatorio.random() < 0.03 else aleatorio.choice(asins)
+                         for _ in range(aleatorio.choice((0, 0, 1, 5, 5, 5)))]
+            f.write(f"  similar: {len(similares)}" + "".join(f"  {similar}" for similar in similares) + "\n")
+
+            caminhos = [_caminho_sintetico(aleatorio, raizes[grupo], arvores[grupo])
+                        for _ in range(aleatorio.randint(0, 5))]
+            f.write(f"  categories: {len(caminhos)}\n")
+            for caminho in caminhos:
+                f.write(f"   {caminho}\n")
+
+            # Poucos produtos concentram muitas avaliações
+            total = int(aleatorio.paretovariate(1.2)) - 1 if aleatorio.random() < 0.8 else 0
+            total = min(total, 300)
+            avaliacoes = []
+            for _ in range(total):
+                ano = aleatorio.randint(1995, 2005)
+                cliente = f"A{int(aleatorio.paretovariate(0.8) * 7919) % n_clientes:013X}"
+                rating = aleatorio.choice((1, 2, 3, 4, 4, 5, 5, 5))
+                votes = int(aleatorio.expovariate(0.3))
+                avaliacoes.append((f"{ano}-{aleatorio.randint(1, 12)}-{aleatorio.randint(1, 28)}", cliente,
+                                   rating, votes, aleatorio.randint(0, votes)))
+            media = sum(a[2] for a in avaliacoes) / total if total else 0
+            f.write(f"  reviews: total: {total}  downloaded: {total}  avg rating: {round(media * 2) / 2:g}\n")
+            for data, cliente, rating, votes, helpful in avaliacoes:
+                f.write(f"    {data}  cutomer: {cliente}  rating: {rating}  votes: {votes:3d}  helpful: {helpful:3d}\n")
+            f.write("\n")
+    return len(asins)
+
+
+def bench_gerar(args):
+    n = gerar_amostra(args.destino, args.produtos, args.semente)
+    print(f"{n} produtos gravados em {args.destino} ({os.path.getsize(args.destino) / 2**20:.1f} MiB)")
+
+
+def _pico_memoria(caminho, fila):
+    n = 0
+    lote = carga.novo_lote()
+    arvore = carga.ArvoreCategorias()
+    asins = {}
+    clientes = carga.Clientes()
+    with open(caminho, "r", encoding="utf8") as arquivo:
+        for produto in carga.extrair_itens(arquivo):
+            carga.transformar(produto, lote, arvore, asins, clientes, carga.config)
+            n += 1
+            if n % carga.TAMANHO_LOTE == 0:
+                lote = carga.novo_lote()
+    # ru_maxrss vem em KiB no Linux
+    fila.put((n, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def bench_memoria(args):
+    # Pico de RSS do parser + transformação para fatias crescentes do arquivo,
+    # cada uma medida num processo novo
+    print(f"{'Produtos':<12} {'Tamanho (MiB)':<15} {'Pico RSS (MiB)':<15}")
+    print("=" * 42)
+    with tempfile.TemporaryDirectory() as pasta:
+        for tamanho in args.tamanhos:
+            fatia = os.path.join(pasta, f"fatia_{tamanho}.txt")
+            fatiar(args.arquivo, tamanho, fatia)
+            fila = multiprocessing.Queue()
+            processo = multiprocessing.Process(target=_pico_memoria, args=(fatia, fila))
+            processo.start()
+            n, pico = fila.get()
+            processo.join()
+            print(f"{n:<12} {os.path.getsize(fatia) / 2**20:<15.1f} {pico / 1024:<15.1f}")
+
+
+def _memoria_registros(linhas, parser):
+    # Bytes alocados para manter todos os registros vivos ao mesmo tempo
+    tracemalloc.start()
+    registros = list(parser(linhas))
+    atual, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(registros), atual
+
+
+def _limitar_avaliacoes(linhas, maximo):
+    # Mesmas linhas, mas com no máximo `maximo` linhas de avaliação por produto
+    saida = []
+    n = 0
+    for linha in linhas:
+        if linha.lstrip()[:4].isdigit():
+            n += 1
+            if n > maximo:
+                continue
+        elif linha.startswith("Id:"):
+            n = 0
+        saida.append(linha)
+    return saida
+
+
+def bench_registros(args):
+    # Dicionário de listas x Produto/Avaliacoes. Bytes por produto vêm dos registros sem
+    # nenhuma avaliação; bytes por avaliação são o custo marginal a partir da segunda
+    # avaliação, para não misturar o custo fixo das colunas de cada produto.
+    with tempfile.TemporaryDirectory() as pasta:
+        fatia = os.path.join(pasta, "fatia.txt")
+        fatiar(args.arquivo, args.produtos, fatia)
+        with open(fatia, "r", encoding="utf8") as arquivo:
+            linhas = arquivo.readlines()
+    sem_avaliacoes = _limitar_avaliacoes(linhas, 0)
+    uma_avaliacao = _limitar_avaliacoes(linhas, 1)
+    n_avaliacoes = len(linhas) - len(sem_avaliacoes)
+    n_marginais = len(linhas) - len(uma_avaliacao)
+
+    print(f"{n_avaliacoes} avaliações, {n_marginais} além da primeira de cada produto")
+    print(f"{'Representação':<15} {'Produtos':<10} {'Total (MiB)':<13} {'Bytes/produto':<15} {'Bytes/avaliação':<15}")
+    print("=" * 70)
+    for nome, parser in (("dicionario", _extrair_cadeia), ("registro", carga.extrair_itens)):
+        n, total = _memoria_registros(linhas, parser)
+        _, base = _memoria_registros(sem_avaliacoes, parser)
+        _, uma = _memoria_registros(uma_avaliacao, parser)
+        por_avaliacao = (total - uma) / n_marginais if n_marginais else 0
+        print(f"{nome:<15} {n:<10} {total / 2**20:<13.1f} {base / n:<15.0f} {por_avaliacao:<15.0f}")
+
+
+def _resumo(produtos):
+    # Conta os produtos e calcula um hash da saída para comparar com o parser serial
+    resumo = hashlib.sha256()
+    n = 0
+    for produto in produtos:
+        resumo.update(repr(produto).encode("utf8"))
+        n += 1
+    return n, resumo.hexdigest()
+
+
+def bench_paralelo(args):
+    # Tempo de leitura com 1..N processos; 1 é o parser serial, usado como referência
+    print(f"{'Workers':<10} {'Segundos':<10} {'Produtos/s':<12} {'Speedup':<10} {'Saída'}")
+    print("=" * 56)
+    base = None
+    for workers in range(1, args.workers + 1):
+        inicio = time.perf_counter()
+        if workers == 1:
+            with open(args.arquivo, "r", encoding="utf8") as arquivo:
+                n, resumo = _resumo(carga.extrair_itens(arquivo))
+        else:
+            n, resumo = _resumo(produto for produto, _ in carga.extrair_itens_paralelo(args.arquivo, workers, args.bloco))
+        segundos = time.perf_counter() - inicio
+        if base is None:
+            base = (segundos, resumo)
+        igual = "idêntica" if resumo == base[1] else "DIFERENTE"
+        print(f"{workers:<10} {segundos:<10.2f} {n / segundos:<12.0f} {base[0] / segundos:<10.2f} {igual}")
+
+
+def _extrair_cadeia(arquivo):
+    # Versão anterior de extrair_itens, com a cadeia de strip()/startswith() por linha,
+    # mantida aqui só como referência para o benchmark do classificador
+    produto = carga.novo_produto()
+    for linha in arquivo:
+        if linha.startswith("Id:"):
+            produto['id'].append(int(linha.split("Id:")[1].strip()))
+        elif linha.startswith("ASIN:"):
+            produto['asin'].append(linha.split("ASIN:")[1].strip())
+        elif linha.strip().startswith("title:"):
+            produto['title'].append(linha.split("title:")[1].strip())
+        elif linha.strip().startswith("group:"):
+            produto['group'].append(linha.split("group:")[1].strip())
+        elif linha.strip().startswith("salesrank:"):
+            produto['salesrank'].append(int(linha.split("salesrank:")[1].strip()))
+        elif linha.strip().startswith("similar:"):
+            produto['similar'].append(linha.split("similar:")[1].strip().split()[1:])
+        elif linha.strip().startswith("|"):
+            lista = linha.strip().split("|")
+            produto['categories'].append([item.strip() for item in lista if item])
+        elif linha.strip().startswith("reviews:"):
+            parts = linha.split()
+            produto['reviews'].append(int(parts[parts.index('total:') + 1]))
+            produto['reviews'].append(int(parts[parts.index('downloaded:') + 1]))
+            produto['reviews'].append(float(parts[parts.index('avg') + 2]))
+        elif linha.lstrip()[:4].isdigit():
+            parts = linha.split()
+            produto['reviews_details'].append([parts[0], parts[2], int(parts[4]), int(parts[6]), int(parts[8])])
+
+        if linha.strip() == "":
+            if produto['id']:
+                yield produto
+            produto = carga.novo_produto()
+
+    if produto['id']:
+        yield produto
+
+
+def bench_classificador(args):
+    # Cadeia antiga x classificador de passada única sobre as linhas de uma fatia
+    # do arquivo já carregadas na memória, para medir só o laço interno
+    with tempfile.TemporaryDirectory() as pasta:
+        fatia = os.path.join(pasta, "fatia.txt")
+        n = fatiar(args.arquivo, args.produtos, fatia)
+        with open(fatia, "r", encoding="utf8") as arquivo:
+            linhas = arquivo.readlines()
+
+    print(f"{n} produtos, {len(linhas)} linhas, melhor de {args.repeticoes} execuções")
+    print(f"{'Parser':<15} {'Segundos':<10} {'Linhas/s':<12}")
+    print("=" * 37)
+    tempos = {}
+    for nome, parser in (("cadeia", _extrair_cadeia), ("classificador", carga.extrair_itens)):
+        melhor = None
+        for _ in range(args.repeticoes):
+            inicio = time.perf_counter()
+            for _ in parser(linhas):
+                pass
+            segundos = time.perf_counter() - inicio
+            melhor = segundos if melhor is None else min(melhor, segundos)
+        tempos[nome] = melhor
+        print(f"{nome:<15} {melhor:<10.3f} {len(linhas) / melhor:<12.0f}")
+    print(f"Speedup: {tempos['cadeia'] / tempos['classificador']:.2f}x")
+
+
+def recriar_tabelas(rapida=False):
+    with psycopg2.connect(**carga.config) as conn:
+        with conn.cursor() as cur:
+            tabelas = [tabela for tabela, _, _, _ in carga.TABELAS]
+            cur.execute(f"DROP TABLE IF EXISTS {', '.join(tabelas)} CASCADE")
+    carga.criar_tabelas(carga.config, rapida)
+
+
+def bench_carga(args):
+    # Carrega o mesmo arquivo num banco limpo em cada modo e compara linhas/s por tabela
+    resultados = {}
+    for modo in args.modos:
+        recriar_tabelas()
+        resultados[modo] = carga.inserir_bd(carga.ler_arquivo(args.arquivo), carga.config, args.lote, modo)
+
+    print(f"{'Tabela':<20} {'Linhas':<10} " + " ".join(f"{modo + ' (linhas/s)':<25}" for modo in args.modos))
+    print("=" * (32 + 26 * len(args.modos)))
+    for tabela, _, _, _ in carga.TABELAS:
+        linhas = resultados[args.modos[0]][tabela][0]
+        taxas = []
+        for modo in args.modos:
+            n, segundos = resultados[modo][tabela]
+            taxas.append(f"{(n / segundos if segundos else 0.0):<25.0f}")
+        print(f"{tabela:<20} {linhas:<10} " + " ".join(taxas))
+
+
+def _alterar_amostra(origem, destino, fracao, semente):
+    # Copia origem mudando o salesrank de uma fração dos produtos, o que muda a impressão
+    # digital deles; devolve quantos produtos foram alterados
+    aleatorio = random.Random(semente)
+    alterar = False
+    alterados = 0
+    with open(origem, "r", encoding="utf8") as entrada, open(destino, "w", encoding="utf8") as saida:
+        for linha in entrada:
+            if linha.startswith("Id:"):
+                alterar = aleatorio.random() < fracao
+            elif alterar and linha.startswith("  salesrank:"):
+                linha = f"  salesrank: {int(linha.split(':')[1]) + 1}\n"
+                alterados += 1
+                alterar = False
+            saida.write(linha)
+    return alterados
+
+
+def _cronometrar_carga(*argumentos):
+    # Tempo de ponta a ponta do tp1_3.2.py, com os resumos e tudo que a linha de comando faz
+    inicio = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(PASTA, "tp1_3.2.py"), *argumentos],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - inicio
+
+
+def bench_delta(args):
+    # Carga completa de um arquivo sintético contra cargas --delta do mesmo arquivo com
+    # uma fração dos produtos alterada; depois de cada delta o arquivo original é
+    # recarregado (fora da medição) para a próxima começar do mesmo estado
+    with tempfile.TemporaryDirectory() as pasta:
+        base = os.path.join(pasta, "base.txt")
+        gerar_amostra(base, args.produtos, args.semente)
+        recriar_tabelas()
+        completa = _cronometrar_carga(base)
+
+        print(f"{'Carga':<22} {'alterados':<11} {'tempo (s)':<11} {'da completa':<12}")
+        print("=" * 56)
+        print(f"{'completa':<22} {args.produtos:<11} {completa:<11.2f} {'100%':<12}")
+        segundos = _cronometrar_carga(base, "--delta")
+        print(f"{'delta sem mudanças':<22} {0:<11} {segundos:<11.2f} {segundos / completa:<12.0%}")
+        for fracao in args.fracoes:
+            alterado = os.path.join(pasta, f"alterado_{fracao}.txt")
+            n = _alterar_amostra(base, alterado, fracao, args.semente)
+            segundos = _cronometrar_carga(alterado, "--delta")
+            print(f"{f'delta {fracao:.0%}':<22} {n:<11} {segundos:<11.2f} {segundos / completa:<12.0%}")
+            _cronometrar_carga(base, "--delta")
+
+
+def bench_rapida(args):
+    # Carga normal (restrições desde o início) x carga rápida (UNLOGGED sem restrições,
+    # finalizada com chaves, validação e SET LOGGED), tempo total até o banco pronto
+    tempos = {}
+    assinaturas = {}
+    for rapida in (False, True):
+        nome = "rápida" if rapida else "normal"
+        recriar_tabelas(rapida)
+        inicio = time.perf_counter()
+        carga.inserir_bd(carga.ler_arquivo(args.arquivo), carga.config, args.lote, 'direto' if rapida else 'copy')
+        carregado = time.perf_counter() - inicio
+        if rapida:
+            carga.finalizar_carga_rapida(carga.config)
+        tempos[nome] = (carregado, time.perf_counter() - inicio)
+        assinaturas[nome] = _assinatura_tabelas()
+
+    print(f"{'Carga':<10} {'Inserção (s)':<14} {'Total (s)':<11} {'Speedup':<10} {'Tabelas'}")
+    print("=" * 58)
+    for nome, (carregado, total) in tempos.items():
+        igual = "idênticas" if assinaturas[nome] == assinaturas['normal'] else "DIFERENTES"
+        print(f"{nome:<10} {carregado:<14.2f} {total:<11.2f} {tempos['normal'][1] / total:<10.2f} {igual}")
+
+
+def bench_escritores(args):
+    # Tempo total da carga em pipeline com 1..N escritores de avaliacoes; a carga
+    # serial (inserir_bd) é a referência do speedup
+    recriar_tabelas()
+    inicio = time.perf_counter()
+    carga.inserir_bd(carga.ler_arquivo(args.arquivo), carga.config, args.lote)
+    base = time.perf_counter() - inicio
+    resultados = [("serial", base, None)]
+    for escritores in range(1, args.writers + 1):
+        recriar_tabelas()
+        inicio = time.perf_counter()
+        estatisticas = carga.inserir_bd_pipeline(carga.ler_arquivo(args.arquivo), carga.config, args.lote,
+                                                 escritores_avaliacoes=escritores)
+        resultados.append((f"pipeline {escritores}", time.perf_counter() - inicio, estatisticas['avaliacoes'][0]))
+
+    print(f"{'Carga':<14} {'Segundos':<10} {'Speedup':<10} {'Avaliações/s':<14}")
+    print("=" * 50)
+    for nome, segundos, avaliacoes in resultados:
+        taxa = f"{avaliacoes / segundos:.0f}" if avaliacoes is not None else "-"
+        print(f"{nome:<14} {segundos:<10.2f} {base / segundos:<10.2f} {taxa:<14}")
+
+
+def _assinatura_tabelas():
+    # Contagem e hash do conteúdo ordenado de cada tabela, para comparar as cargas
+    assinatura = {}
+    with psycopg2.connect(**carga.config) as conn:
+        with conn.cursor() as cur:
+            for tabela, colunas, _, _ in carga.TABELAS:
+                cur.execute(f"SELECT count(*), md5(coalesce(string_agg(t::text, ',' ORDER BY t::text), '')) FROM {tabela} t")
+                assinatura[tabela] = cur.fetchone()
+    return assinatura
+
+
+def bench_cache(args):
+    # Tempo até o banco carregado: texto (sem cache), primeira carga com cache (gera o
+    # cache e carrega dele) e carga com o cache já válido
+    with tempfile.TemporaryDirectory() as pasta:
+        tempos = {}
+        assinaturas = {}
+
+        recriar_tabelas()
+        inicio = time.perf_counter()
+        carga.inserir_bd(carga.ler_arquivo(args.arquivo, args.workers), carga.config, args.lote)
+        tempos['texto'] = time.perf_counter() - inicio
+        assinaturas['texto'] = _assinatura_tabelas()
+
+        recriar_tabelas()
+        inicio = time.perf_counter()
+        carga.gerar_cache(args.arquivo, pasta, args.workers, args.lote)
+        geracao = time.perf_counter() - inicio
+        carga.carregar_cache(pasta, carga.config)
+        tempos['cache frio'] = time.perf_counter() - inicio
+        assinaturas['cache frio'] = _assinatura_tabelas()
+
+        recriar_tabelas()
+        inicio = time.perf_counter()
+        valido = carga.cache_valido(pasta, args.arquivo)
+        carga.carregar_cache(pasta, carga.config)
+        tempos['cache'] = time.perf_counter() - inicio
+        assinaturas['cache'] = _assinatura_tabelas()
+        tamanho = sum(os.path.getsize(os.path.join(pasta, nome)) for nome in os.listdir(pasta))
+
+    print(f"Cache: {tamanho / 2**20:.1f} MiB, gerado em {geracao:.2f} segundos, válido na segunda carga: {valido}")
+    print(f"{'Carga':<12} {'Segundos':<10} {'Speedup':<10} {'Tabelas'}")
+    print("=" * 45)
+    for nome, segundos in tempos.items():
+        igual = "idênticas" if assinaturas[nome] == assinaturas['texto'] else "DIFERENTES"
+        print(f"{nome:<12} {segundos:<10.2f} {tempos['texto'] / segundos:<10.2f} {igual}")
+
+
+def _amostrar(query, n):
+    with psycopg2.connect(**carga.config) as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, (n,))
+            return [linha[0] for linha in cur.fetchall()]
+
+
+def _sql_direto(nome):
+    # Texto da consulta com %(p1)s no lugar de $1, para executar sem PREPARE
+    return painel.notacao_psycopg(painel.CONSULTAS[nome][1])
+
+
+def _percentis(amostras):
+    q = statistics.quantiles(amostras, n=100)
+    return q[49] * 1000, q[98] * 1000
+
+
+def bench_consultas(args):
+    # Latência de cada consulta do dashboard abrindo uma conexão por chamada (como antes)
+    # e pelo pool com consultas preparadas; p50/p99 em milissegundos
+    produtos = _amostrar("SELECT product_id FROM produtos WHERE title IS NOT NULL ORDER BY random() LIMIT %s", args.repeticoes)
+    categorias = _amostrar("SELECT category_id FROM categoria ORDER BY random() LIMIT %s", args.repeticoes)
+
+    print(f"{'Consulta':<35} {'sem pool p50':<14} {'sem pool p99':<14} {'pool p50':<12} {'pool p99':<12}")
+    print("=" * 87)
+    for nome, (tipo, _) in painel.CONSULTAS.items():
+        if args.consultas and nome not in args.consultas:
+            continue
+        ids = categorias if nome.endswith("_categoria") else produtos
+        parametros = [(random.choice(ids),) if tipo else () for _ in range(args.repeticoes)]
+
+        sem_pool = []
+        sql = _sql_direto(nome)
+        for params in parametros:
+            inicio = time.perf_counter()
+            conn = psycopg2.connect(**carga.config)
+            cur = conn.cursor()
+            cur.execute(sql, {"p1": params[0]} if params else None)
+            cur.fetchall()
+            cur.close()
+            conn.close()
+            sem_pool.append(time.perf_counter() - inicio)
+
+        com_pool = []
+        for params in parametros:
+            inicio = time.perf_counter()
+            painel.consultar(carga.config, nome, params)
+            com_pool.append(time.perf_counter() - inicio)
+
+        print(f"{nome:<35} " + " ".join(f"{v:<13.2f}" for v in _percentis(sem_pool)) + " "
+              + " ".join(f"{v:<12.2f}" for v in _percentis(com_pool)))
+
+
+
+# Consulta g de ponta a ponta (agregação do resumo + 10 primeiros por grupo) com o código
+# do cliente em cada avaliação, como era, e com o id inteiro ligado a cliente só no final
+CONSULTA_G_CODIGO = """
+    SELECT customer_id, n_reviews, review_rank, product_group FROM (
+        SELECT t.product_group, t.customer_id, t.n_reviews,
+               ROW_NUMBER() OVER (PARTITION BY t.product_group ORDER BY t.n_reviews DESC) AS review_rank
+        FROM (
+            SELECT p.product_group, r.customer_id, COUNT(*) AS n_reviews
+            FROM produtos p
+            INNER JOIN avaliacoes_codigo r ON p.product_id = r.product_id
+            GROUP BY p.product_group, r.customer_id
+        ) t
+    ) g
+    WHERE review_rank <= 10
+"""
+CONSULTA_G_ID = """
+    SELECT c.customer_code, g.n_reviews, g.review_rank, g.product_group FROM (
+        %s
+    ) g
+    INNER JOIN cliente c ON c.customer_id = g.customer_id
+    WHERE g.review_rank <= 10
+"""
+
+
+def bench_clientes(args):
+    # avaliacoes com o código do cliente (a tabela antiga, recriada a partir da atual com a
+    # mesma chave primária) x com o id inteiro: tamanho e tempo da consulta g sem o resumo
+    conn = psycopg2.connect(**carga.config)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS avaliacoes_codigo")
+    cur.execute("""
+        CREATE TABLE avaliacoes_codigo AS
+        SELECT a.product_id, c.customer_code::varchar(16) AS customer_id, a.review_date, a.rating, a.votes, a.helpful
+        FROM avaliacoes a
+        JOIN cliente c ON c.customer_id = a.customer_id
+    """)
+    cur.execute("ALTER TABLE avaliacoes_codigo ADD PRIMARY KEY (product_id, customer_id, review_date)")
+    for tabela in ("avaliacoes_codigo", "avaliacoes", "cliente"):
+        cur.execute(f"VACUUM FULL ANALYZE {tabela}")
+    tamanhos = {}
+    for nome, tabela, indice in (("código", "avaliacoes_codigo", "avaliacoes_codigo_pkey"),
+                                 ("id", "avaliacoes", "avaliacoes_pkey")):
+        cur.execute("SELECT pg_relation_size(%s), pg_relation_size(%s)", (tabela, indice))
+        tamanhos[nome] = cur.fetchone()
+    cur.execute("SELECT pg_total_relation_size('cliente')")
+    tamanho_cliente = cur.fetchone()[0]
+
+    resumo = dict((nome, query) for nome, query, _, _ in carga.RESUMOS)['resumo_clientes_grupo']
+    tempos = {"código": [], "id": []}
+    resultados = {}
+    for _ in range(args.repeticoes):
+        for nome, sql in (("código", CONSULTA_G_CODIGO), ("id", CONSULTA_G_ID % resumo)):
+            inicio = time.perf_counter()
+            cur.execute(sql)
+            # Empates no número de avaliações podem trazer clientes diferentes no
+            # ROW_NUMBER, então a comparação fica em (avaliações, posição, grupo)
+            resultados[nome] = sorted(linha[1:] for linha in cur.fetchall())
+            tempos[nome].append(time.perf_counter() - inicio)
+    cur.execute("DROP TABLE avaliacoes_codigo")
+    conn.close()
+
+    print(f"cliente (dicionário código -> id): {tamanho_cliente / 2**20:.1f} MiB")
+    print(f"{'Cliente':<8} {'Tabela (MiB)':<14} {'Chave (MiB)':<13} {'g mediana (ms)':<16} {'g melhor (ms)':<14}")
+    print("=" * 68)
+    for nome, (tabela, indice) in tamanhos.items():
+        print(f"{nome:<8} {tabela / 2**20:<14.1f} {indice / 2**20:<13.1f} "
+              f"{statistics.median(tempos[nome]) * 1000:<16.1f} {min(tempos[nome]) * 1000:<14.1f}")
+    igual = "iguais" if resultados["código"] == resultados["id"] else "DIFERENTES"
+    print(f"Resultados da consulta g nas duas versões: {igual}")
+
+
+# Consulta b como era com os pares de ASIN, sobre a tabela recriada por bench_similares
+CONSULTA_B_ASIN = """
+    SELECT psimilar.title, psimilar.salesrank
+    FROM produtos p
+    JOIN similares_asin sp ON p.asin = sp.product_asin
+    JOIN produtos psimilar ON psimilar.asin = sp.similar_asin
+    WHERE p.product_id = %(p1)s
+    AND psimilar.salesrank < p.salesrank
+"""
+
+
+def bench_similares(args):
+    # Pares de ASIN (a tabela antiga, recriada a partir dos pares de ids com a mesma chave
+    # primária e o índice em similar_asin) x pares de ids: tamanho e latência da consulta b
+    conn = psycopg2.connect(**carga.config)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS similares_asin")
+    cur.execute("""
+        CREATE TABLE similares_asin AS
+        SELECT p.asin AS product_asin, s.asin AS similar_asin
+        FROM produtos_similares ps
+        JOIN produtos p ON p.product_id = ps.product_id
+        JOIN produtos s ON s.product_id = ps.similar_id
+        UNION
+        SELECT p.asin, sp.similar_asin
+        FROM similares_pendentes sp
+        JOIN produtos p ON p.product_id = sp.product_id
+    """)
+    cur.execute("ALTER TABLE similares_asin ADD PRIMARY KEY (product_asin, similar_asin)")
+    cur.execute("CREATE INDEX ON similares_asin (similar_asin)")
+    # A resolução no fim da carga apaga as pendentes resolvidas; o VACUUM FULL tira essas
+    # linhas mortas do tamanho medido
+    for tabela in ("similares_asin", "produtos_similares", "similares_pendentes"):
+        cur.execute(f"VACUUM FULL ANALYZE {tabela}")
+    cur.execute("""
+        SELECT pg_total_relation_size('similares_asin'),
+               pg_total_relation_size('produtos_similares') + pg_total_relation_size('similares_pendentes'),
+               (SELECT count(*) FROM similares_asin),
+               (SELECT count(*) FROM produtos_similares) + (SELECT count(*) FROM similares_pendentes)
+    """)
+    tamanho_asin, tamanho_ids, linhas_asin, linhas_ids = cur.fetchone()
+
+    produtos = _amostrar("SELECT product_id FROM produtos_similares ORDER BY random() LIMIT %s", args.repeticoes)
+    tempos = {"asin": [], "ids": []}
+    diferentes = 0
+    sql_ids = _sql_direto('listar_similares_maiores_vendas')
+    for product_id in [random.choice(produtos) for _ in range(args.repeticoes)]:
+        resultados = []
+        for nome, sql in (("asin", CONSULTA_B_ASIN), ("ids", sql_ids)):
+            inicio = time.perf_counter()
+            cur.execute(sql, {"p1": product_id})
+            resultados.append(sorted(cur.fetchall(), key=repr))
+            tempos[nome].append(time.perf_counter() - inicio)
+        diferentes += resultados[0] != resultados[1]
+    cur.execute("DROP TABLE similares_asin")
+    conn.close()
+
+    print(f"{'Pares':<8} {'Linhas':<10} {'Tamanho (MiB)':<15} {'b p50 (ms)':<12} {'b p99 (ms)':<12}")
+    print("=" * 60)
+    for nome, linhas, tamanho in (("asin", linhas_asin, tamanho_asin), ("ids", linhas_ids, tamanho_ids)):
+        p50, p99 = _percentis(tempos[nome])
+        print(f"{nome:<8} {linhas:<10} {tamanho / 2**20:<15.1f} {p50:<12.2f} {p99:<12.2f}")
+    print(f"Resultados diferentes entre as duas versões: {diferentes} de {args.repeticoes}")
+
+
+def _varreduras(plano, encontradas):
+    # Lista as varreduras de tabelas e índices do plano
+    alvo = plano.get("Index Name") or plano.get("Relation Name")
+    if alvo:
+        encontradas.append(f"{plano['Node Type']} {alvo}")
+    for filho in plano.get("Plans", []):
+        _varreduras(filho, encontradas)
+    return encontradas
+
+
+def _explicar(cur, nome, params):
+    cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + _sql_direto(nome), {"p1": params[0]} if params else None)
+    resultado = cur.fetchone()[0][0]
+    return resultado["Execution Time"], _varreduras(resultado["Plan"], [])
+
+
+def bench_indices(args):
+    # EXPLAIN ANALYZE das consultas b, d, e, f e g sem os índices secundários e depois
+    # de criar_indices. Os índices são removidos antes para a medição ser repetível.
+    consultas = ('listar_similares_maiores_vendas', 'listar_mais_vendidos', 'listar_produtos',
+                 'listar_categorias', 'listar_clientes')
+    produto = _amostrar("SELECT product_id FROM produtos_similares LIMIT %s", 1) or [1]
+
+    conn = psycopg2.connect(**carga.config)
+    conn.autocommit = True
+    cur = conn.cursor()
+    for nome, _ in carga.INDICES:
+        cur.execute(f"DROP INDEX IF EXISTS {nome}")
+    for tabela, _, _, _ in carga.TABELAS:
+        cur.execute(f"ANALYZE {tabela}")
+
+    antes = {nome: _explicar(cur, nome, produto if painel.CONSULTAS[nome][0] else ()) for nome in consultas}
+    carga.criar_indices(carga.config)
+    depois = {nome: _explicar(cur, nome, produto if painel.CONSULTAS[nome][0] else ()) for nome in consultas}
+    cur.close()
+    conn.close()
+
+    for nome in consultas:
+        print(f"\n{nome}: {antes[nome][0]:.2f} ms -> {depois[nome][0]:.2f} ms")
+        print(f"  antes:  {', '.join(antes[nome][1])}")
+        print(f"  depois: {', '.join(depois[nome][1])}")
+
+
+
+# Consulta da opção a antes da correção: produtos x avaliacoes sem predicado de junção
+LISTA_5_ANTIGA = """
+    (
+    SELECT produtos.product_id, produtos.asin, avaliacoes.customer_id, avaliacoes.review_date, avaliacoes.rating, avaliacoes.helpful
+    FROM produtos, avaliacoes
+    WHERE produtos.product_id=%(p1)s
+    ORDER BY rating DESC, helpful DESC
+    LIMIT 5
+    )
+    UNION ALL
+    (
+    SELECT produtos.product_id, produtos.asin, avaliacoes.customer_id, avaliacoes.review_date, avaliacoes.rating, avaliacoes.helpful
+    FROM produtos, avaliacoes
+    WHERE produtos.product_id=%(p1)s
+    ORDER BY rating ASC, helpful DESC
+    LIMIT 5
+    )
+"""
+
+
+def _lista_5_esperada(cur, product_id):
+    # Resultado calculado em Python a partir de todas as avaliações do produto;
+    # compara só (nota, úteis), já que empates podem trazer clientes diferentes
+    cur.execute("SELECT rating, helpful FROM avaliacoes WHERE product_id = %s", (product_id,))
+    avaliacoes = cur.fetchall()
+    maiores = sorted(avaliacoes, key=lambda r: (-r[0], -r[1]))[:5]
+    menores = sorted(avaliacoes, key=lambda r: (r[0], -r[1]))[:5]
+    return maiores + menores
+
+
+def bench_lista5(args):
+    # Confere a consulta da opção a contra o resultado esperado e compara a latência
+    # com a consulta antiga
+    produtos = _amostrar("SELECT DISTINCT product_id FROM avaliacoes ORDER BY product_id LIMIT %s", args.repeticoes)
+    tempos = {"antiga": [], "nova": []}
+    erradas = {"antiga": 0, "nova": 0}
+    with psycopg2.connect(**carga.config) as conn:
+        with conn.cursor() as cur:
+            for product_id in produtos:
+                esperada = _lista_5_esperada(cur, product_id)
+
+                inicio = time.perf_counter()
+                cur.execute(LISTA_5_ANTIGA, {"p1": product_id})
+                antiga = cur.fetchall()
+                tempos["antiga"].append(time.perf_counter() - inicio)
+
+                inicio = time.perf_counter()
+                nova = painel.consultar(carga.config, "lista_5", (product_id,))
+                tempos["nova"].append(time.perf_counter() - inicio)
+
+                for nome, linhas in (("antiga", antiga), ("nova", nova)):
+                    if [(linha[4], linha[5]) for linha in linhas] != esperada:
+                        erradas[nome] += 1
+
+    print(f"{len(produtos)} produtos com avaliações")
+    print(f"{'Consulta':<10} {'p50 (ms)':<10} {'p99 (ms)':<10} {'Resultados errados'}")
+    print("=" * 50)
+    for nome in ("antiga", "nova"):
+        p50, p99 = _percentis(tempos[nome])
+        print(f"{nome:<10} {p50:<10.2f} {p99:<10.2f} {erradas[nome]}")
+
+
+def bench_cache_consultas(args):
+    # Consultas de ranking sem cache e com o cache de resultados; depois de incrementar a
+    # geração (como faz uma carga) a primeira chamada de cada consulta tem de ser uma falha
+    cacheaveis = painel.CACHEAVEIS
+    painel.CACHEAVEIS = ()
+    sem_cache = {nome: [] for nome in cacheaveis}
+    for nome in cacheaveis:
+        for _ in range(args.repeticoes):
+            inicio = time.perf_counter()
+            painel.consultar(carga.config, nome)
+            sem_cache[nome].append(time.perf_counter() - inicio)
+    painel.CACHEAVEIS = cacheaveis
+
+    painel.cache = painel.CacheResultados(pasta=args.pasta)
+    com_cache = {nome: [] for nome in cacheaveis}
+    for nome in cacheaveis:
+        for _ in range(args.repeticoes):
+            inicio = time.perf_counter()
+            painel.consultar(carga.config, nome)
+            com_cache[nome].append(time.perf_counter() - inicio)
+    relatorio = painel.cache.relatorio()
+
+    with psycopg2.connect(**carga.config) as conn:
+        with conn.cursor() as cur:
+            carga.incrementar_geracao(cur)
+    falhas = painel.cache.falhas
+    for nome in cacheaveis:
+        painel.consultar(carga.config, nome)
+    invalidadas = painel.cache.falhas - falhas
+
+    print(f"{'Consulta':<25} {'sem cache p50 (ms)':<20} {'com cache p50 (ms)':<20}")
+    print("=" * 65)
+    for nome in cacheaveis:
+        print(f"{nome:<25} {_percentis(sem_cache[nome])[0]:<20.2f} {_percentis(com_cache[nome])[0]:<20.2f}")
+    print(f"Taxa de acerto: {relatorio['taxa_acerto']:.1%} ({relatorio['acertos']} acertos, {relatorio['falhas']} falhas), "
+          f"{relatorio['economizado_s'] * 1000:.1f} ms economizados")
+    print(f"Depois de uma nova geração: {invalidadas} de {len(cacheaveis)} consultas recalculadas")
+
+
+def bench_lote(args):
+    # Opções a, b e c para N produtos: uma consulta preparada por produto (pelo pool) contra
+    # uma consulta em lote com a lista inteira; produtos por segundo de cada forma
+    todos = _amostrar("SELECT product_id FROM produtos ORDER BY random() LIMIT %s", max(args.tamanhos))
+    aleatorio = random.Random(args.semente)
+
+    print(f"{'Consulta':<35} {'IDs':<8} {'por chamada (IDs/s)':<21} {'em lote (IDs/s)':<17} {'ganho':<6}")
+    print("=" * 90)
+    for nome in ('lista_5', 'listar_similares_maiores_vendas', 'evolucao_medias_avaliacao'):
+        for n in args.tamanhos:
+            # Sem produtos suficientes no banco, a lista repete ids
+            ids = todos[:n] if n <= len(todos) else aleatorio.choices(todos, k=n)
+
+            inicio = time.perf_counter()
+            for product_id in ids:
+                painel.consultar(carga.config, nome, (product_id,))
+            por_chamada = time.perf_counter() - inicio
+
+            inicio = time.perf_counter()
+            for _ in painel.consultar_por_produto(carga.config, f"{nome}_lote", ids):
+                pass
+            em_lote = time.perf_counter() - inicio
+
+            print(f"{nome:<35} {n:<8} {n / por_chamada:<21.0f} {n / em_lote:<17.0f} {por_chamada / em_lote:.1f}x")
+
+
+def _ler_relatorio(nome, itersize, fila):
+    # Lê o relatório inteiro (fetchall se itersize for None) e devolve o tempo e quanto o
+    # pico de RSS cresceu durante a leitura, em KiB; o RSS inclui o resultado guardado pela libpq
+    query, chave = painel.RELATORIOS[nome]
+    antes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    inicio = time.perf_counter()
+    if itersize is None:
+        with painel.conexao(carga.config) as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"{query} ORDER BY {', '.join(expressao for expressao, _ in chave)}")
+                n = len(cur.fetchall())
+    else:
+        n = sum(1 for _ in painel.iterar_relatorio(carga.config, nome, itersize))
+    fila.put((n, time.perf_counter() - inicio, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - antes))
+
+
+def bench_cursores(args):
+    # Relatórios completos lidos de uma vez (fetchall) e por cursor nomeado com vários
+    # itersize, cada leitura num processo novo, e o custo de uma página no início e no fim
+    # do relatório com OFFSET e por chave
+    for nome, (query, chave) in painel.RELATORIOS.items():
+        ordem = ", ".join(expressao for expressao, _ in chave)
+
+        print(f"\n{nome}")
+        print(f"{'Leitura':<25} {'linhas':<10} {'tempo (s)':<12} {'pico RSS (MiB)':<15}")
+        print("=" * 62)
+        for itersize in [None] + args.itersize:
+            # O processo filho não pode herdar as conexões abertas do pool
+            painel.fechar_pools()
+            fila = multiprocessing.Queue()
+            processo = multiprocessing.Process(target=_ler_relatorio, args=(nome, itersize, fila))
+            processo.start()
+            total, segundos, pico = fila.get()
+            processo.join()
+            rotulo = "fetchall" if itersize is None else f"cursor (itersize {itersize})"
+            print(f"{rotulo:<25} {total:<10} {segundos:<12.2f} {pico / 1024:<15.1f}")
+
+        # A última página começa depois da linha total - pagina; a chave dela vem dessa linha
+        deslocamento = max(total - args.pagina, 1)
+        with painel.conexao(carga.config) as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"{query} ORDER BY {ordem} LIMIT 1 OFFSET %s", (deslocamento - 1,))
+                linha = cur.fetchone()
+        ultima = tuple(linha[posicao] for _, posicao in chave)
+
+        print(f"{'Página':<25} {'OFFSET (ms)':<12} {'chave (ms)':<10}")
+        for rotulo, deslocamento, depois in (("início", 0, None), ("fim", deslocamento, ultima)):
+            offset = []
+            por_chave = []
+            for _ in range(args.repeticoes):
+                inicio = time.perf_counter()
+                with painel.conexao(carga.config) as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(f"{query} ORDER BY {ordem} LIMIT %s OFFSET %s", (args.pagina, deslocamento))
+                        cur.fetchall()
+                offset.append(time.perf_counter() - inicio)
+                inicio = time.perf_counter()
+                painel.pagina_relatorio(carga.config, nome, depois, args.pagina)
+                por_chave.append(time.perf_counter() - inicio)
+            print(f"{rotulo:<25} {statistics.median(offset) * 1000:<12.2f} {statistics.median(por_chave) * 1000:<10.2f}")
+
+
+def _exportar_python(letras, ids, pasta):
+    # Exportação como seria sem o COPY: linhas trazidas para o Python e escritas pelo csv
+    for letra in letras:
+        nome = painel.OPCOES[letra]
+        with open(os.path.join(pasta, f"{letra}.csv"), "w", encoding="utf8", newline="") as f:
+            escritor = csv.writer(f)
+            if painel.CONSULTAS[nome][0]:
+                for product_id, linhas in painel.consultar_por_produto(carga.config, f"{nome}_lote", ids):
+                    escritor.writerows((product_id, *linha) for linha in linhas)
+            else:
+                escritor.writerows(painel.consultar(carga.config, nome))
+
+
+def bench_relatorios(args):
+    # Todos os relatórios a-g: linhas pelo Python + csv, COPY um relatório por vez e
+    # COPY com os relatórios em paralelo pelo pool
+    ids = _amostrar("SELECT product_id FROM produtos ORDER BY random() LIMIT %s", args.ids)
+    letras = painel.RELATORIOS_EXPORTAVEIS
+    print(f"{'Exportação':<30} {'tempo (s)':<10}")
+    print("=" * 40)
+    with tempfile.TemporaryDirectory() as pasta:
+        inicio = time.perf_counter()
+        _exportar_python(letras, ids, pasta)
+        print(f"{'Python + csv':<30} {time.perf_counter() - inicio:<10.2f}")
+
+        for formato in painel.FORMATOS:
+            for paralelos in (1, painel.TAMANHO_POOL):
+                # O relatório de cada exportação é descartado, só o tempo total importa
+                with contextlib.redirect_stdout(io.StringIO()):
+                    inicio = time.perf_counter()
+                    falhas = painel.executar_relatorios(carga.config, letras, ids, formato, pasta, paralelos)
+                    segundos = time.perf_counter() - inicio
+                rotulo = f"COPY {formato}, {paralelos} por vez"
+                print(f"{rotulo:<30} {segundos:<10.2f}" + (f" ({falhas} falhas)" if falhas else ""))
+
+
+async def _requisitar(leitor, escritor, caminho):
+    # GET numa conexão mantida aberta; devolve o status da resposta
+    escritor.write(f"GET {caminho} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin1"))
+    await escritor.drain()
+    status = int((await leitor.readline()).split()[1])
+    tamanho = 0
+    while True:
+        cabecalho = await leitor.readline()
+        if cabecalho == b"\r\n":
+            break
+        chave, _, valor = cabecalho.decode("latin1").partition(":")
+        if chave.lower() == "content-length":
+            tamanho = int(valor)
+    await leitor.readexactly(tamanho)
+    return status
+
+
+async def _carga_servico(porta, caminhos, concorrencia):
+    # concorrencia clientes, cada um com a sua conexão, consumindo a mesma fila de caminhos
+    fila = iter(caminhos)
+    latencias = []
+    falhas = []
+
+    async def cliente():
+        leitor, escritor = await asyncio.open_connection("127.0.0.1", porta)
+        for caminho in fila:
+            inicio = time.perf_counter()
+            status = await _requisitar(leitor, escritor, caminho)
+            latencias.append(time.perf_counter() - inicio)
+            if status != 200:
+                falhas.append(status)
+        escritor.close()
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(cliente() for _ in range(concorrencia)))
+    return time.perf_counter() - inicio, latencias, falhas
+
+
+def bench_servico(args):
+    # Sobe o servico_consultas.py em outro processo e mede vazão e latência das opções
+    # a, b e c com um número crescente de clientes simultâneos
+    produtos = _amostrar("SELECT product_id FROM produtos WHERE title IS NOT NULL ORDER BY random() LIMIT %s", 1000)
+    aleatorio = random.Random(args.semente)
+    caminhos = [f"/{aleatorio.choice('abc')}?id={aleatorio.choice(produtos)}" for _ in range(args.requisicoes)]
+
+    servidor = subprocess.Popen(
+        [sys.executable, os.path.join(PASTA, "servico_consultas.py"), "--porta", str(args.porta),
+         "--limite", str(args.limite), "--pool", str(args.pool)],
+        stdout=subprocess.PIPE, text=True)
+    try:
+        # O serviço avisa na saída quando já está aceitando conexões
+        servidor.stdout.readline()
+        if servidor.poll() is not None:
+            sys.exit("O serviço de consultas não subiu.")
+
+        print(f"{'Clientes':<10} {'req/s':<10} {'p50 (ms)':<10} {'p99 (ms)':<10} {'falhas':<8}")
+        print("=" * 50)
+        for concorrencia in args.concorrencia:
+            total, latencias, falhas = asyncio.run(_carga_servico(args.porta, caminhos, concorrencia))
+            p50, p99 = _percentis(latencias)
+            print(f"{concorrencia:<10} {len(latencias) / total:<10.0f} {p50:<10.2f} {p99:<10.2f} {len(falhas):<8}")
+    finally:
+        servidor.terminate()
+        servidor.wait()
+
+
+def _versao():
+    # Commit do repositório, se houver, para identificar os resultados
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PASTA, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(args):
+    # Gera (ou usa) um arquivo, mede o parser, a carga de cada tabela e cada consulta do
+    # dashboard, e grava tudo num JSON para comparar versões com o subcomando comparar
+    resultados = {
+        'versao': _versao(),
+        'data': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'maquina': platform.platform(),
+    }
+    with tempfile.TemporaryDirectory() as pasta:
+        arquivo = args.arquivo
+        if arquivo is None:
+            arquivo = os.path.join(pasta, "amazon-meta-sintetico.txt")
+            inicio = time.perf_counter()
+            gerar_amostra(arquivo, args.produtos, args.semente)
+            resultados['gerador'] = {'produtos': args.produtos, 'semente': args.semente,
+                                     'segundos': time.perf_counter() - inicio}
+        resultados['arquivo'] = {'bytes': os.path.getsize(arquivo)}
+
+        melhor = None
+        for _ in range(args.repeticoes_parser):
+            inicio = time.perf_counter()
+            with open(arquivo, "r", encoding="utf8") as f:
+                n = sum(1 for _ in carga.extrair_itens(f))
+            segundos = time.perf_counter() - inicio
+            melhor = segundos if melhor is None else min(melhor, segundos)
+        resultados['parser'] = {'produtos': n, 'segundos': melhor, 'produtos_s': n / melhor}
+
+        recriar_tabelas()
+        inicio = time.perf_counter()
+        estatisticas = carga.inserir_bd(carga.ler_arquivo(arquivo), carga.config, args.lote)
+        total = time.perf_counter() - inicio
+    etapas = {}
+    for nome, funcao in (("indices", carga.criar_indices), ("resumos", carga.atualizar_resumos)):
+        inicio = time.perf_counter()
+        funcao(carga.config)
+        etapas[nome] = time.perf_counter() - inicio
+    resultados['carga'] = {
+        'segundos': total,
+        'tabelas': {tabela: {'linhas': linhas, 'segundos': segundos, 'linhas_s': linhas / segundos if segundos else None}
+                    for tabela, (linhas, segundos) in estatisticas.items()},
+        **{f"{nome}_segundos": segundos for nome, segundos in etapas.items()},
+    }
+
+    produtos = _amostrar("SELECT product_id FROM avaliacoes ORDER BY random() LIMIT %s", args.repeticoes)
+    categorias = _amostrar("SELECT category_id FROM categoria ORDER BY random() LIMIT %s", args.repeticoes)
+    resultados['consultas'] = {}
+    for nome, (tipo, _) in painel.CONSULTAS.items():
+        ids = categorias if nome.endswith("_categoria") else produtos
+        tempos = []
+        for _ in range(args.repeticoes):
+            params = (random.choice(ids),) if tipo else ()
+            inicio = time.perf_counter()
+            painel.consultar(carga.config, nome, params)
+            tempos.append(time.perf_counter() - inicio)
+        p50, p99 = _percentis(tempos)
+        resultados['consultas'][nome] = {'p50_ms': p50, 'p99_ms': p99, 'media_ms': statistics.mean(tempos) * 1000}
+
+    with open(args.saida, "w", encoding="utf8") as f:
+        json.dump(resultados, f, indent=2, ensure_ascii=False)
+
+    print(f"\nParser: {resultados['parser']['produtos_s']:.0f} produtos/s; carga: {total:.2f} segundos")
+    print(f"{'Consulta':<35} {'p50 (ms)':<10} {'p99 (ms)':<10}")
+    print("=" * 55)
+    for nome, tempos in resultados['consultas'].items():
+        print(f"{nome:<35} {tempos['p50_ms']:<10.2f} {tempos['p99_ms']:<10.2f}")
+    print(f"Resultados gravados em {args.saida}")
+
+
+def _metricas(resultados):
+    # Achata o JSON da suíte em {métrica: (valor, maior_melhor)}
+    metricas = {'parser produtos/s': (resultados['parser']['produtos_s'], True),
+                'carga segundos': (resultados['carga']['segundos'], False)}
+    for tabela, valores in resultados['carga']['tabelas'].items():
+        if valores['linhas_s']:
+            metricas[f"{tabela} linhas/s"] = (valores['linhas_s'], True)
+    for nome, valores in resultados['consultas'].items():
+        metricas[f"{nome} p50 ms"] = (valores['p50_ms'], False)
+        metricas[f"{nome} p99 ms"] = (valores['p99_ms'], False)
+    return metricas
+
+
+def bench_comparar(args):
+    # Compara dois JSON da suíte; variações piores que --tolerancia são marcadas
+    with open(args.antes, "r", encoding="utf8") as f:
+        antes = _metricas(json.load(f))
+    with open(args.depois, "r", encoding="utf8") as f:
+        depois = _metricas(json.load(f))
+
+    print(f"{'Métrica':<45} {'Antes':<12} {'Depois':<12} {'Variação':<10}")
+    print("=" * 82)
+    regressoes = 0
+    for nome, (valor_antes, maior_melhor) in antes.items():
+        if nome not in depois:
+            continue
+        valor_depois = depois[nome][0]
+        variacao = (valor_depois - valor_antes) / valor_antes * 100 if valor_antes else 0.0
+        pior = -variacao if maior_melhor else variacao
+        marca = "  REGRESSÃO" if pior > args.tolerancia else ""
+        regressoes += bool(marca)
+        print(f"{nome:<45} {valor_antes:<12.2f} {valor_depois:<12.2f} {variacao:+9.1f}%{marca}")
+    print(f"{regressoes} regressões acima de {args.tolerancia:.0f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks da carga e das consultas")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("gerar", help="gera um amazon-meta.txt sintético")
+    p.add_argument("destino")
+    p.add_argument("--produtos", type=int, default=100000)
+    p.add_argument("--semente", type=int, default=1)
+    p.set_defaults(funcao=bench_gerar)
+
+    p = sub.add_parser("suite", help="parser, carga por tabela e consultas do dashboard, com os resultados em JSON")
+    p.add_argument("arquivo", nargs="?", help="padrão: gera um arquivo sintético com --produtos")
+    p.add_argument("--produtos", type=int, default=50000)
+    p.add_argument("--semente", type=int, default=1)
+    p.add_argument("--lote", type=int, default=carga.TAMANHO_LOTE)
+    p.add_argument("--repeticoes", type=int, default=100, help="execuções de cada consulta")
+    p.add_argument("--repeticoes-parser", type=int, default=3)
+    p.add_argument("--saida", default="resultados.json")
+    p.set_defaults(funcao=bench_suite)
+
+    p = sub.add_parser("cache-consultas", help="taxa de acerto e tempo economizado pelo cache de resultados do dashboard")
+    p.add_argument("--repeticoes", type=int, default=50)
+    p.add_argument("--pasta", help="pasta do cache em disco (padrão: só memória)")
+    p.set_defaults(funcao=bench_cache_consultas)
+
+    p = sub.add_parser("lote", help="consultas a, b e c produto a produto contra as versões em lote")
+    p.add_argument("--tamanhos", type=int, nargs="+", default=[10, 1000, 100000])
+    p.add_argument("--semente", type=int, default=1)
+    p.set_defaults(funcao=bench_lote)
+
+    p = sub.add_parser("cursores", help="relatórios completos com fetchall, cursor nomeado e paginação por chave")
+    p.add_argument("--itersize", type=int, nargs="+", default=[100, 2000, 20000])
+    p.add_argument("--pagina", type=int, default=20)
+    p.add_argument("--repeticoes", type=int, default=20)
+    p.set_defaults(funcao=bench_cursores)
+
+    p = sub.add_parser("relatorios", help="exportação dos relatórios a-g pelo Python e por COPY, serial e em paralelo")
+    p.add_argument("--ids", type=int, default=10000, help="produtos dos relatórios a, b e c")
+    p.set_defaults(funcao=bench_relatorios)
+
+    p = sub.add_parser("delta", help="carga completa contra cargas --delta com uma fração dos produtos alterada")
+    p.add_argument("--produtos", type=int, default=20000)
+    p.add_argument("--fracoes", type=float, nargs="+", default=[0.01, 0.1])
+    p.add_argument("--semente", type=int, default=1)
+    p.set_defaults(funcao=bench_delta)
+
+    p = sub.add_parser("servico", help="vazão e latência do servico_consultas.py com clientes simultâneos")
+    p.add_argument("--requisicoes", type=int, default=2000)
+    p.add_argument("--concorrencia", type=int, nargs="+", default=[1, 8, 32, 128])
+    p.add_argument("--porta", type=int, default=8089)
+    p.add_argument("--limite", type=int, default=32)
+    p.add_argument("--pool", type=int, default=10)
+    p.add_argument("--semente", type=int, default=1)
+    p.set_defaults(funcao=bench_servico)
+
+    p = sub.add_parser("comparar", help="compara dois JSON da suíte e marca as regressões")
+    p.add_argument("antes")
+    p.add_argument("depois")
+    p.add_argument("--tolerancia", type=float, default=10.0, help="piora máxima aceita, em %%")
+    p.set_defaults(funcao=bench_comparar)
+
+    p = sub.add_parser("memoria", help="pico de memória do parser conforme o tamanho da entrada")
+    p.add_argument("arquivo")
+    p.add_argument("--tamanhos", type=int, nargs="+", default=[10000, 50000, 100000, 200000])
+    p.set_defaults(funcao=bench_memoria)
+
+    p = sub.add_parser("registros", help="bytes por produto e por avaliação: dicionário de listas x registro compacto")
+    p.add_argument("arquivo")
+    p.add_argument("--produtos", type=int, default=50000, help="tamanho da fatia do arquivo")
+    p.set_defaults(funcao=bench_registros)
+
+    p = sub.add_parser("paralelo", help="escalabilidade da leitura paralela de 1 a N processos")
+    p.add_argument("arquivo")
+    p.add_argument("--workers", type=int, default=os.cpu_count())
+    p.add_argument("--bloco", type=int, default=carga.TAMANHO_BLOCO, help="tamanho aproximado de cada faixa em bytes")
+    p.set_defaults(funcao=bench_paralelo)
+
+    p = sub.add_parser("classificador", help="classificador de linhas x cadeia de startswith")
+    p.add_argument("arquivo")
+    p.add_argument("--produtos", type=int, default=100000, help="tamanho da fatia do arquivo")
+    p.add_argument("--repeticoes", type=int, default=3)
+    p.set_defaults(funcao=bench_classificador)
+
+    p = sub.add_parser("carga", help="linhas/s por tabela em cada modo de carga")
+    p.add_argument("arquivo")
+    p.add_argument("--modos", nargs="+", choices=carga.MODOS, default=list(carga.MODOS))
+    p.add_argument("--lote", type=int, default=carga.TAMANHO_LOTE)
+    p.set_defaults(funcao=bench_carga)
+
+    p = sub.add_parser("rapida", help="carga normal x carga rápida com restrições criadas e validadas depois")
+    p.add_argument("arquivo")
+    p.add_argument("--lote", type=int, default=carga.TAMANHO_LOTE)
+    p.set_defaults(funcao=bench_rapida)
+
+    p = sub.add_parser("escritores", help="tempo da carga em pipeline com 1 a N escritores paralelos de avaliacoes")
+    p.add_argument("arquivo")
+    p.add_argument("--writers", type=int, default=4)
+    p.add_argument("--lote", type=int, default=carga.TAMANHO_LOTE)
+    p.set_defaults(funcao=bench_escritores)
+
+    p = sub.add_parser("cache", help="tempo até o banco carregado: texto x cache binário frio x cache válido")
+    p.add_argument("arquivo")
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--lote", type=int, default=carga.TAMANHO_LOTE)
+    p.set_defaults(funcao=bench_cache)
+
+    p = sub.add_parser("consultas", help="latência p50/p99 das consultas com e sem pool de conexões")
+    p.add_argument("--repeticoes", type=int, default=200)
+    p.add_argument("--consultas", nargs="*", choices=list(painel.CONSULTAS), help="padrão: todas")
+    p.set_defaults(funcao=bench_consultas)
+
+    p = sub.add_parser("indices", help="EXPLAIN ANALYZE das consultas antes e depois dos índices secundários")
+    p.set_defaults(funcao=bench_indices)
+
+    p = sub.add_parser("similares", help="pares de ASIN x pares de ids: tamanho da tabela e latência da consulta b")
+    p.add_argument("--repeticoes", type=int, default=200)
+    p.set_defaults(funcao=bench_similares)
+
+    p = sub.add_parser("clientes", help="código x id inteiro do cliente em avaliacoes: tamanho e tempo da consulta g")
+    p.add_argument("--repeticoes", type=int, default=5)
+    p.set_defaults(funcao=bench_clientes)
+
+    p = sub.add_parser("lista5", help="correção e latência da consulta da opção a, antiga x nova")
+    p.add_argument("--repeticoes", type=int, default=200)
+    p.set_defaults(funcao=bench_lista5)
+
+    args = parser.parse_args()
+    args.funcao(args)
@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+import datetime
+import decimal
+import importlib.util
+import json
+import os
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+
+# O tp1_3.3.py tem ponto no nome, então é carregado pelo caminho; dele vêm a config e as
+# consultas (CONSULTAS já usa a notação $1, que é a mesma do asyncpg)
+_spec = importlib.util.spec_from_file_location("painel", os.path.join(PASTA, "tp1_3.3.py"))
+painel = importlib.util.module_from_spec(_spec)
+sys.modules["painel"] = painel
+_spec.loader.exec_module(painel)
+
+# As letras do menu do tp1_3.3.py; /a?id=... é o mesmo que /lista_5?id=...
+ROTAS = painel.OPCOES
+
+# Consultas executando ao mesmo tempo; as demais esperam até ESPERA segundos por uma vaga
+LIMITE = 32
+ESPERA = 1.0
+# Tempo máximo de uma consulta no banco, em segundos
+TIMEOUT = 5.0
+TAMANHO_POOL = 10
+
+MENSAGENS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+             500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+def _json(valor):
+    # Tipos das linhas do banco que o json não conhece
+    if isinstance(valor, (datetime.date, datetime.datetime)):
+        return valor.isoformat()
+    if isinstance(valor, decimal.Decimal):
+        return float(valor)
+    raise TypeError(f"tipo não serializável: {type(valor).__name__}")
+
+
+class SemConexao(Exception):
+    # Nenhuma conexão do pool ficou livre dentro do tempo de espera
+    pass
+
+
+class ServicoConsultas:
+    # Servidor HTTP mínimo (GET, keep-alive) sobre um pool do asyncpg, com limite de
+    # consultas simultâneas e timeout por consulta
+    def __init__(self, config, limite=LIMITE, espera=ESPERA, timeout=TIMEOUT, tamanho_pool=TAMANHO_POOL):
+        self.config = config
+        self.espera = espera
+        self.timeout = timeout
+        self.tamanho_pool = tamanho_pool
+        self.vagas = asyncio.Semaphore(limite)
+        self.pool = None
+        self.contadores = {'requisicoes': 0, 'em_andamento': 0, 'recusadas': 0, 'timeouts': 0, 'erros': 0}
+
+    async def iniciar(self):
+        if asyncpg is None:
+            raise RuntimeError("o serviço de consultas precisa do asyncpg (pip install asyncpg)")
+        self.pool = await asyncpg.create_pool(
+            host=self.config['host'], port=int(self.config['port']), user=self.config['user'],
+            password=self.config['password'], database=self.config['dbname'],
+            min_size=1, max_size=self.tamanho_pool)
+
+    async def fechar(self):
+        if self.pool is not None:
+            await self.pool.close()
+
+    async def consultar(self, nome, params):
+        # O asyncpg prepara e guarda cada consulta por conexão, como o PREPARE do tp1_3.3.py.
+        # Com --limite maior que --pool as requisições admitidas também esperam por uma
+        # conexão, e essa espera tem o mesmo limite da espera por uma vaga
+        try:
+            conn = await self.pool.acquire(timeout=self.espera)
+        except asyncio.TimeoutError:
+            raise SemConexao from None
+        try:
+            linhas = await conn.fetch(painel.CONSULTAS[nome][1], *params, timeout=self.timeout)
+        finally:
+            await self.pool.release(conn)
+        return [tuple(linha) for linha in linhas]
+
+    async def responder(self, metodo, alvo):
+        # (status, corpo) de uma requisição
+        if metodo != "GET":
+            return 405, {'erro': "só GET é aceito"}
+        url = urlsplit(alvo)
+        caminho = url.path.strip("/")
+        if caminho == "status":
+            return 200, self.contadores
+        nome = ROTAS.get(caminho, caminho)
+        if nome not in painel.CONSULTAS:
+            return 404, {'erro': f"consulta desconhecida: {caminho}"}
+
+        params = ()
+        if painel.CONSULTAS[nome][0]:
+            try:
+                params = (int(parse_qs(url.query)['id'][0]),)
+            except (KeyError, ValueError):
+                return 400, {'erro': "parâmetro id inteiro obrigatório"}
+
+        try:
+            await asyncio.wait_for(self.vagas.acquire(), self.espera)
+        except asyncio.TimeoutError:
+            self.contadores['recusadas'] += 1
+            return 503, {'erro': "serviço ocupado"}
+        self.contadores['em_andamento'] += 1
+        try:
+            return 200, {'consulta': nome, 'linhas': await self.consultar(nome, params)}
+        except SemConexao:
+            self.contadores['recusadas'] += 1
+            return 503, {'erro': "nenhuma conexão livre com o banco"}
+        except asyncio.TimeoutError:
+            self.contadores['timeouts'] += 1
+            return 504, {'erro': f"a consulta passou de {self.timeout} s"}
+        except asyncpg.PostgresError as e:
+            self.contadores['erros'] += 1
+            return 500, {'erro': str(e)}
+        finally:
+            self.contadores['em_andamento'] -= 1
+            self.vagas.release()
+
+    async def atender(self, leitor, escritor):
+        # Uma conexão do cliente; várias requisições seguidas se o cliente mantiver a conexão
+        try:
+            while True:
+                linha = await leitor.readline()
+                if not linha:
+                    break
+                try:
+                    metodo, alvo, versao = linha.decode("latin1").split()
+                except ValueError:
+                    await self.enviar(escritor, 400, {'erro': "requisição malformada"}, False)
+                    break
+                cabecalhos = {}
+                while True:
+                    cabecalho = await leitor.readline()
+                    if cabecalho in (b"\r\n", b"\n", b""):
+                        break
+                    chave, _, valor = cabecalho.decode("latin1").partition(":")
+                    cabecalhos[chave.strip().lower()] = valor.strip().lower()
+                manter = versao == "HTTP/1.1" and cabecalhos.get("connection") != "close"
+
+                self.contadores['requisicoes'] += 1
+                status, corpo = await self.responder(metodo, alvo)
+                await self.enviar(escritor, status, corpo, manter)
+                if not manter:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            escritor.close()
+
+    async def enviar(self, escritor, status, corpo, manter):
+        dados = json.dumps(corpo, default=_json, ensure_ascii=False).encode("utf8")
+        escritor.write(
+            f"HTTP/1.1 {status} {MENSAGENS[status]}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(dados)}\r\n"
+            f"Connection: {'keep-alive' if manter else 'close'}\r\n\r\n".encode("latin1") + dados)
+        await escritor.drain()
+
+
+async def servir(config, host, porta, **opcoes):
+    servico = ServicoConsultas(config, **opcoes)
+    await servico.iniciar()
+    servidor = await asyncio.start_server(servico.atender, host, porta)
+    print(f"Servindo as consultas em http://{host}:{porta}/ (ex.: /a?id=1, /status)", flush=True)
+    try:
+        async with servidor:
+            await servidor.serve_forever()
+    finally:
+        await servico.fechar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serviço HTTP das consultas do dashboard")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8080)
+    parser.add_argument("--limite", type=int, default=LIMITE,
+                        help="consultas executando ao mesmo tempo")
+    parser.add_argument("--espera", type=float, default=ESPERA,
+                        help="segundos que uma requisição espera por uma vaga antes do 503")
+    parser.add_argument("--timeout", type=float, default=TIMEOUT,
+                        help="tempo máximo de uma consulta, em segundos (504 depois disso)")
+    parser.add_argument("--pool", type=int, default=TAMANHO_POOL, help="conexões no pool do asyncpg")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    try:
+        asyncio.run(servir(painel.config, args.host, args.porta, limite=args.limite, espera=args.espera,
+                           timeout=args.timeout, tamanho_pool=args.pool))
+    except KeyboardInterrupt:
+        print(f"Serviço encerrado depois de {time.perf_counter() - inicio:.0f} s.")
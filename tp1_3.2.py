@@ -1,65 +1,135 @@
+import argparse
+import collections
+import datetime
+import hashlib
+import io
+import json
+import mmap
+import multiprocessing
+import os
+import queue
+import sys
+import threading
 import psycopg2
 from tqdm import tqdm
 import re
+import struct
 import time
+from array import array
+from typing import NamedTuple, Optional, Tuple
 
-def criar_tabelas(config):
-    commands = (
-        """
-        CREATE TABLE IF NOT EXISTS produtos (
-            product_id INTEGER NOT NULL PRIMARY KEY,
-            asin VARCHAR(10) NOT NULL UNIQUE,
+# Colunas de cada tabela, na ordem de criação; as restrições ficam em RESTRICOES
+ESQUEMA = (
+    ('produtos', """
+            product_id INTEGER NOT NULL,
+            asin VARCHAR(10) NOT NULL,
             title VARCHAR(500),
             product_group VARCHAR(50),
             salesrank INTEGER,
             review_total INTEGER DEFAULT 0,
             review_downloaded INTEGER DEFAULT 0,
             review_avg FLOAT DEFAULT 0.0
-        );
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS produtos_similares (
-            product_asin VARCHAR(10) NOT NULL,
-            similar_asin VARCHAR(10) NOT NULL,
-            PRIMARY KEY (product_asin, similar_asin),
-            FOREIGN KEY (product_asin) REFERENCES produtos(asin)
-        );
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS categoria (
-            category_id INTEGER NOT NULL PRIMARY KEY,
-            name VARCHAR(220),
-            parent_id INTEGER,
-            FOREIGN KEY (parent_id) REFERENCES categoria(category_id)
-        );
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS produto_categoria (
+    """),
+    ('produtos_similares', """
+            product_id INTEGER NOT NULL,
+            similar_id INTEGER NOT NULL
+    """),
+    # Similares cujo ASIN não está no arquivo
+    ('similares_pendentes', """
             product_id INTEGER NOT NULL,
+            similar_asin VARCHAR(10) NOT NULL
+    """),
+    ('categoria', """
             category_id INTEGER NOT NULL,
-            PRIMARY KEY (product_id, category_id),
-            FOREIGN KEY (product_id) REFERENCES produtos(product_id),
-            FOREIGN KEY (category_id) REFERENCES categoria(category_id)
-        );
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS avaliacoes (
+            name VARCHAR(220),
+            parent_id INTEGER
+    """),
+    ('produto_categoria', """
             product_id INTEGER NOT NULL,
-            customer_id VARCHAR(16) NOT NULL,
+            category_id INTEGER NOT NULL
+    """),
+    ('cliente', """
+            customer_id INTEGER NOT NULL,
+            customer_code VARCHAR(16) NOT NULL
+    """),
+    ('avaliacoes', """
+            product_id INTEGER NOT NULL,
+            customer_id INTEGER NOT NULL,
             review_date DATE NOT NULL,
             rating INTEGER DEFAULT 0,
             votes INTEGER DEFAULT 0,
-            helpful INTEGER DEFAULT 0,
-            PRIMARY KEY (product_id, customer_id, review_date),
-            FOREIGN KEY (product_id) REFERENCES produtos(product_id)
+            helpful INTEGER DEFAULT 0
+    """),
+    ('produto_hash', """
+            product_id INTEGER NOT NULL,
+            hash BYTEA NOT NULL
+    """),
+)
+
+# (tabela, nome, tipo, colunas, tabela e colunas referenciadas). Os nomes são os que o
+# PostgreSQL daria às restrições declaradas na própria tabela.
+RESTRICOES = (
+    ('produtos', 'produtos_pkey', 'PRIMARY KEY', ('product_id',), None),
+    ('produtos', 'produtos_asin_key', 'UNIQUE', ('asin',), None),
+    ('produtos_similares', 'produtos_similares_pkey', 'PRIMARY KEY', ('product_id', 'similar_id'), None),
+    ('produtos_similares', 'produtos_similares_product_id_fkey', 'FOREIGN KEY', ('product_id',), ('produtos', ('product_id',))),
+    ('produtos_similares', 'produtos_similares_similar_id_fkey', 'FOREIGN KEY', ('similar_id',), ('produtos', ('product_id',))),
+    ('similares_pendentes', 'similares_pendentes_pkey', 'PRIMARY KEY', ('product_id', 'similar_asin'), None),
+    ('similares_pendentes', 'similares_pendentes_product_id_fkey', 'FOREIGN KEY', ('product_id',), ('produtos', ('product_id',))),
+    ('categoria', 'categoria_pkey', 'PRIMARY KEY', ('category_id',), None),
+    ('categoria', 'categoria_parent_id_fkey', 'FOREIGN KEY', ('parent_id',), ('categoria', ('category_id',))),
+    ('produto_categoria', 'produto_categoria_pkey', 'PRIMARY KEY', ('product_id', 'category_id'), None),
+    ('produto_categoria', 'produto_categoria_product_id_fkey', 'FOREIGN KEY', ('product_id',), ('produtos', ('product_id',))),
+    ('produto_categoria', 'produto_categoria_category_id_fkey', 'FOREIGN KEY', ('category_id',), ('categoria', ('category_id',))),
+    ('cliente', 'cliente_pkey', 'PRIMARY KEY', ('customer_id',), None),
+    ('cliente', 'cliente_customer_code_key', 'UNIQUE', ('customer_code',), None),
+    ('avaliacoes', 'avaliacoes_pkey', 'PRIMARY KEY', ('product_id', 'customer_id', 'review_date'), None),
+    ('avaliacoes', 'avaliacoes_product_id_fkey', 'FOREIGN KEY', ('product_id',), ('produtos', ('product_id',))),
+    ('avaliacoes', 'avaliacoes_customer_id_fkey', 'FOREIGN KEY', ('customer_id',), ('cliente', ('customer_id',))),
+    ('produto_hash', 'produto_hash_pkey', 'PRIMARY KEY', ('product_id',), None),
+    ('produto_hash', 'produto_hash_product_id_fkey', 'FOREIGN KEY', ('product_id',), ('produtos', ('product_id',))),
+)
+
+
+def definicao_restricao(tipo, colunas, referencia):
+    definicao = f"{tipo} ({', '.join(colunas)})"
+    if referencia is not None:
+        definicao += f" REFERENCES {referencia[0]}({', '.join(referencia[1])})"
+    return definicao
+
+
+def criar_tabelas(config, rapida=False):
+    # Na carga rápida as tabelas são UNLOGGED e sem restrições; elas são adicionadas
+    # e validadas depois da carga por finalizar_carga_rapida
+    commands = []
+    for tabela, colunas in ESQUEMA:
+        if rapida:
+            commands.append(f"CREATE UNLOGGED TABLE IF NOT EXISTS {tabela} ({colunas});")
+        else:
+            restricoes = [f"CONSTRAINT {nome} {definicao_restricao(tipo, cols, ref)}"
+                          for t, nome, tipo, cols, ref in RESTRICOES if t == tabela]
+            commands.append(f"CREATE TABLE IF NOT EXISTS {tabela} ({colunas.rstrip()},\n            "
+                            + ",\n            ".join(restricoes) + "\n);")
+    commands.append("""
+        CREATE TABLE IF NOT EXISTS carga_controle (
+            arquivo VARCHAR(500) NOT NULL PRIMARY KEY,
+            tamanho BIGINT NOT NULL,
+            hash VARCHAR(32),
+            byte_offset BIGINT NOT NULL,
+            ultimo_id INTEGER,
+            atualizado_em TIMESTAMP NOT NULL DEFAULT now()
         );
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS cliente (
-            customer_id VARCHAR(16) NOT NULL PRIMARY KEY
+        """)
+    # Bancos criados antes do hash em carga_controle; os checkpoints deles não são retomados
+    commands.append("ALTER TABLE carga_controle ADD COLUMN IF NOT EXISTS hash VARCHAR(32);")
+    # Uma única linha com a geração dos dados, lida pelo cache de consultas do tp1_3.3.py
+    commands.append("""
+        CREATE TABLE IF NOT EXISTS carga_geracao (
+            id BOOLEAN NOT NULL PRIMARY KEY DEFAULT TRUE CHECK (id),
+            geracao BIGINT NOT NULL,
+            atualizado_em TIMESTAMP NOT NULL DEFAULT now()
         );
-        """
-    )
+        """)
 
     try:
         with psycopg2.connect(**config) as conn:
@@ -74,337 +144,1359 @@ def criar_tabelas(config):
     except (psycopg2.DatabaseError, Exception) as error:
         print(f"Erro ao criar tabelas: {error}")
 
-def extract_category_id(category_str):
-    
-    match = re.search(r'\[(\d+)\]', category_str)
-    if match:
-        return match.group(1) 
-    return None 
-def products(produto, config):
-    products_data = []
 
-    data_dict = produto
-    itens_nao_vazios = {k: v for k, v in data_dict.items() if v != []}
-    quantidade_itens = len(itens_nao_vazios)
+def tabelas_existentes(config):
+    with psycopg2.connect(**config) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT tablename FROM pg_tables WHERE schemaname = current_schema() AND tablename = ANY(%s)",
+                        ([tabela for tabela, _ in ESQUEMA],))
+            return [tabela for tabela, in cur.fetchall()]
 
-    
-    if quantidade_itens == 2:
-        products_data = list(zip(data_dict['id'], data_dict['asin']))
-    else:
-        total_reviews, downloaded_reviews, average_rating = data_dict['reviews']
-        products_data = list(zip(
-            data_dict['id'],
-            data_dict['asin'],
-            data_dict['title'],
-            data_dict['group'],
-            data_dict['salesrank'],
-            [total_reviews],     
-            [downloaded_reviews], 
-            [average_rating]      
-        ))
 
- 
-    for i in range(len(products_data)):
-        if len(products_data[i]) < 8:
-            products_data[i] += (None,) * (8 - len(products_data[i]))
+def finalizar_carga_rapida(config):
+    # Depois da carga rápida: remove as linhas repetidas nas chaves, passa as tabelas para
+    # LOGGED (antes dos índices, para a reescrita não carregar índices junto), cria as chaves
+    # primárias e únicas, cria as chaves estrangeiras como NOT VALID, remove as linhas órfãs
+    # e valida. As violações são contadas e mostradas no relatório em vez de abortar a carga.
+    relatorio = []
+    with psycopg2.connect(**config) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT conname FROM pg_constraint WHERE conrelid = ANY(%s::regclass[])",
+                        ([tabela for tabela, _ in ESQUEMA],))
+            existentes = {nome for nome, in cur.fetchall()}
 
-    return products_data
+            for tabela, nome, tipo, colunas, _ in RESTRICOES:
+                if tipo == 'FOREIGN KEY' or nome in existentes:
+                    continue
+                inicio = time.time()
+                # Fica a primeira linha de cada chave, como no ON CONFLICT DO NOTHING da carga
+                # normal: as tabelas só receberam COPY, então a ordem do ctid é a da inserção
+                cur.execute(f"""
+                    DELETE FROM {tabela} WHERE ctid IN (
+                        SELECT ctid FROM (
+                            SELECT ctid, row_number() OVER (PARTITION BY {', '.join(colunas)} ORDER BY ctid) AS n
+                            FROM {tabela}
+                        ) repetidas
+                        WHERE n > 1
+                    )
+                """)
+                relatorio.append([nome, "linhas repetidas removidas", cur.rowcount, time.time() - inicio])
+            conn.commit()
 
+            for tabela, _ in ESQUEMA:
+                inicio = time.time()
+                cur.execute(f"ALTER TABLE {tabela} SET LOGGED")
+                conn.commit()
+                relatorio.append([tabela, "SET LOGGED", None, time.time() - inicio])
 
-def reviews(produto, config):
-    review_details_data = []
-    customer_ids = set()
-    
-    data_dict = produto
-    product_id = data_dict['id'][0]  
+            for tabela, nome, tipo, colunas, referencia in RESTRICOES:
+                if nome in existentes:
+                    continue
+                inicio = time.time()
+                if tipo != 'FOREIGN KEY':
+                    cur.execute(f"ALTER TABLE {tabela} ADD CONSTRAINT {nome} {definicao_restricao(tipo, colunas, referencia)}")
+                    conn.commit()
+                    relatorio.append([nome, tipo, None, time.time() - inicio])
+                    continue
+                cur.execute(f"ALTER TABLE {tabela} ADD CONSTRAINT {nome} {definicao_restricao(tipo, colunas, referencia)} NOT VALID")
+                alvo, colunas_alvo = referencia
+                ligacao = " AND ".join(f"r.{c_alvo} = t.{c}" for c, c_alvo in zip(colunas, colunas_alvo))
+                nao_nulas = " AND ".join(f"t.{c} IS NOT NULL" for c in colunas)
+                cur.execute(f"DELETE FROM {tabela} t WHERE {nao_nulas} AND NOT EXISTS (SELECT 1 FROM {alvo} r WHERE {ligacao})")
+                orfas = cur.rowcount
+                cur.execute(f"ALTER TABLE {tabela} VALIDATE CONSTRAINT {nome}")
+                conn.commit()
+                relatorio.append([nome, "órfãs removidas, validada", orfas, time.time() - inicio])
 
-  
-    for review in data_dict['reviews_details']:
-        if len(review) == 5:
-            review_date, user_id, rating, helpfulness, total_votes = review
-            review_details_data.append((
-                product_id, 
-                review_date, 
-                user_id, 
-                rating, 
-                helpfulness, 
-                total_votes
-            ))
-            customer_ids.add(user_id)
+            # Similares que apontam para produtos que não estão no arquivo não são violação:
+            # ficam em similares_pendentes e só são contados
+            cur.execute("SELECT count(*) FROM similares_pendentes")
+            relatorio.append(["similares_pendentes", "ASINs fora do arquivo", cur.fetchone()[0], 0.0])
 
-    return review_details_data, customer_ids
+    print(f"{'Restrição':<40} {'Etapa':<30} {'Violações':<10} {'Segundos':<10}")
+    print("=" * 92)
+    for nome, etapa, violacoes, segundos in relatorio:
+        print(f"{nome:<40} {etapa:<30} {'-' if violacoes is None else violacoes:<10} {segundos:<10.2f}")
+    return relatorio
 
+# "Nome[id]"; o id é o último colchete do segmento
+CATEGORIA = re.compile(r'(.*)\[(\d+)\]$')
 
 
+def products(produto, config):
+    if produto.reviews is None:
+        # Produto descontinuado: só Id e ASIN
+        total_reviews = downloaded_reviews = average_rating = None
+    else:
+        total_reviews, downloaded_reviews, average_rating = produto.reviews
+
+    return [(
+        produto.id,
+        produto.asin,
+        produto.title,
+        produto.group,
+        produto.salesrank,
+        total_reviews,
+        downloaded_reviews,
+        average_rating
+    )]
+
+
+def reviews(produto, config, clientes):
+    # Devolve as avaliações com o id inteiro do cliente e as linhas de cliente novas
+    review_details_data = []
+    customer_data = []
+
+    for review_date, user_code, rating, votes, helpful in produto.avaliacoes or ():
+        user_id, novo = clientes.internar(user_code)
+        if novo:
+            customer_data.append((user_id, user_code))
+        review_details_data.append((
+            produto.id,
+            review_date,
+            user_id,
+            rating,
+            votes,
+            helpful
+        ))
+
+    return review_details_data, customer_data
+
 
 def similar(produto, config):
-    similar_products_data = []
-    
-    data_dict = produto
+    return [(produto.id, similar_asin) for similar_asin in produto.similares]
+
+
+class Clientes(dict):
+    # Código do cliente -> customer_id inteiro, atribuído na ordem em que aparece.
+    # Nas cargas começa com os clientes já gravados (carregar_clientes), para um código
+    # que já está no banco manter o seu id e os novos continuarem a numeração.
+    def __init__(self, existentes=()):
+        super().__init__(existentes)
+        self.proximo = max(self.values(), default=0) + 1
+
+    def internar(self, codigo):
+        # (customer_id, True se o cliente ainda não tinha id)
+        customer_id = self.get(codigo)
+        if customer_id is not None:
+            return customer_id, False
+        customer_id = self[codigo] = self.proximo
+        self.proximo += 1
+        return customer_id, True
 
-  
-    for i, similar_asins in enumerate(data_dict['similar']):
-        if len(similar_asins) > 1 and i < len(data_dict['asin']):
-            for similar_asin in similar_asins:
-                similar_products_data.append((data_dict['asin'][i], similar_asin))
 
-    return similar_products_data
+class ArvoreCategorias:
+    # Trie dos caminhos de categoria montada durante a leitura. Cada category_id é
+    # emitido uma única vez, na primeira vez que aparece, já com o pai verdadeiro.
+    def __init__(self):
+        self.raiz = {}
+        self.pais = {}
+        self.segmentos = 0
 
+    def inserir(self, caminho):
+        # Devolve o id da folha do caminho e a lista de nós novos (id, nome, pai)
+        novos = []
+        filhos = self.raiz
+        pai = None
+        for segmento in caminho:
+            match = CATEGORIA.match(segmento)
+            if not match:
+                continue
+            self.segmentos += 1
+            category_id = int(match.group(2))
+            no = filhos.get(category_id)
+            if no is None:
+                no = filhos[category_id] = {}
+                if category_id not in self.pais:
+                    self.pais[category_id] = pai
+                    novos.append((category_id, match.group(1).strip(), pai))
+            filhos = no
+            pai = category_id
+        return pai, novos
 
 
-def category(produto, config):
+def category(produto, arvore):
     category_data = []
-    
-    data_dict = produto
+    folhas = set()
 
-    
-    for category_list in data_dict['categories']:
-        for category in category_list:
-            category_id = extract_category_id(category)
-            if category_id:
-                category_name = category.split('[')[0].strip()
-                category_data.append((int(category_id), category_name, None))
+    for category_list in produto.categorias:
+        folha, novos = arvore.inserir(category_list)
+        category_data.extend(novos)
+        if folha is not None:
+            folhas.add(folha)
 
-    return category_data
+    return category_data, folhas
 
 
-def prodcategory(produto, config):
-    product_category_data = []
-    
-    data_dict = produto
+def prodcategory(produto, folhas):
+    # Só as folhas distintas dos caminhos do produto; os ancestrais ficam na
+    # tabela categoria_fechamento (criar_fechamento) em vez de linhas repetidas
+    return [(produto.id, category_id) for category_id in sorted(folhas)]
 
-    
-    for product_id in data_dict['id']:
-        for category_list in data_dict['categories']:
-            for category_str in category_list:
-                category_id = extract_category_id(category_str)
-                if category_id:  
-                    product_category_data.append((product_id, category_id))
 
-    return product_category_data
+def criar_fechamento(config):
+    # Tabela de fechamento transitivo da árvore de categorias: um par
+    # (ancestral, descendente, distância) para cada categoria e cada ancestral dela
+    commands = (
+        """
+        CREATE TABLE IF NOT EXISTS categoria_fechamento (
+            ancestor_id INTEGER NOT NULL,
+            descendant_id INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (ancestor_id, descendant_id),
+            FOREIGN KEY (ancestor_id) REFERENCES categoria(category_id),
+            FOREIGN KEY (descendant_id) REFERENCES categoria(category_id)
+        );
+        """,
+        "TRUNCATE categoria_fechamento;",
+        """
+        INSERT INTO categoria_fechamento (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE f AS (
+            SELECT category_id AS ancestor_id, category_id AS descendant_id, 0 AS depth
+            FROM categoria
+            UNION ALL
+            SELECT c.parent_id, f.descendant_id, f.depth + 1
+            FROM f
+            INNER JOIN categoria c ON c.category_id = f.ancestor_id
+            WHERE c.parent_id IS NOT NULL
+        )
+        SELECT ancestor_id, descendant_id, depth FROM f;
+        """,
+    )
+
+    try:
+        with psycopg2.connect(**config) as conn:
+            with conn.cursor() as cur:
+                start_time = time.time()
+                for command in commands:
+                    cur.execute(command)
+                linhas = cur.rowcount
+                conn.commit()
+                print(f"Fechamento das categorias criado: {linhas} pares em {time.time() - start_time:.2f} segundos.")
+
+    except (psycopg2.DatabaseError, Exception) as error:
+        print(f"Erro ao criar fechamento das categorias: {error}")
+
+
+# Índices secundários usados pelas consultas do dashboard (tp1_3.3.py). São criados
+# depois da carga, com os dados já no lugar, e não na criação das tabelas.
+INDICES = (
+    # a: 5 melhores e 5 piores avaliações de um produto, só com varredura do índice
+    ('idx_avaliacoes_top', "avaliacoes (product_id, rating, helpful) INCLUDE (customer_id, review_date)"),
+    # d: ranking por salesrank dentro de cada grupo
+    ('idx_produtos_grupo_salesrank', "produtos (product_group, salesrank)"),
+    # e, f: só as avaliações úteis, agrupadas por produto
+    ('idx_avaliacoes_util', "avaliacoes (product_id, helpful) WHERE helpful > 0"),
+    # g: contagem de avaliações por cliente
+    ('idx_avaliacoes_cliente', "avaliacoes (customer_id)"),
+    # f e subárvores de categoria
+    ('idx_produto_categoria_categoria', "produto_categoria (category_id)"),
+    ('idx_categoria_pai', "categoria (parent_id)"),
+)
+
+
+def criar_indices(config):
+    # CREATE INDEX CONCURRENTLY não roda dentro de transação, por isso o autocommit.
+    # Um índice deixado inválido por uma execução interrompida é recriado.
+    try:
+        conn = psycopg2.connect(**config)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                for nome, definicao in INDICES:
+                    cur.execute("""
+                        SELECT i.indisvalid
+                        FROM pg_class c
+                        INNER JOIN pg_index i ON i.indexrelid = c.oid
+                        WHERE c.relname = %s
+                    """, (nome,))
+                    existente = cur.fetchone()
+                    if existente and not existente[0]:
+                        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}")
+
+                    start_time = time.time()
+                    tabela, colunas = definicao.split(" ", 1)
+                    cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nome} ON {tabela} {colunas}")
+                    print(f"Índice {nome} criado em {time.time() - start_time:.2f} segundos.")
+
+                for tabela, _, _, _ in TABELAS:
+                    cur.execute(f"ANALYZE {tabela}")
+        finally:
+            conn.close()
+
+    except (psycopg2.DatabaseError, Exception) as error:
+        print(f"Erro ao criar índices: {error}")
+
+
+# Resumos materializados lidos pelas consultas c, e, f e g do dashboard, na ordem em
+# que precisam ser atualizados (resumo_categoria depende de resumo_helpful_produto).
+# Cada um tem a consulta, a chave do índice único idx_<resumo> (exigido pelo REFRESH
+# CONCURRENTLY) e um índice secundário opcional para a consulta do dashboard
+RESUMOS = (
+    ('resumo_clientes_grupo', """
+        SELECT t.product_group, t.customer_id, t.n_reviews,
+               ROW_NUMBER() OVER (PARTITION BY t.product_group ORDER BY t.n_reviews DESC) AS review_rank
+        FROM (
+            SELECT p.product_group, r.customer_id, COUNT(*) AS n_reviews
+            FROM produtos p
+            INNER JOIN avaliacoes r ON p.product_id = r.product_id
+            GROUP BY p.product_group, r.customer_id
+        ) t
+    """, "(review_rank, product_group)", None),
+    ('resumo_helpful_produto', """
+        SELECT t.product_id, t.product_group, t.n_helpful, t.avg_helpful,
+               ROW_NUMBER() OVER (PARTITION BY t.product_group ORDER BY t.avg_helpful DESC) AS n_rank
+        FROM (
+            SELECT p.product_id, p.product_group, COUNT(*) AS n_helpful, ROUND(AVG(r.helpful), 2) AS avg_helpful
+            FROM produtos p
+            INNER JOIN avaliacoes r ON r.product_id = p.product_id
+            WHERE r.helpful > 0
+            GROUP BY p.product_id, p.product_group
+        ) t
+    """, "(n_rank, product_group)", None),
+    ('resumo_categoria', """
+        SELECT pc.category_id, AVG(h.n_helpful) AS avg_helpful
+        FROM produto_categoria pc
+        INNER JOIN resumo_helpful_produto h ON h.product_id = pc.product_id
+        GROUP BY pc.category_id
+    """, "(category_id)", "(avg_helpful DESC)"),
+    ('resumo_media_diaria', """
+        SELECT r.product_id, r.review_date, ROUND(AVG(r.rating), 2) AS avg_rating
+        FROM avaliacoes r
+        GROUP BY r.product_id, r.review_date
+    """, "(product_id, review_date)", None),
+)
+
+
+def indexar_resumo(cur, nome, chave, indice):
+    # Bancos de antes do REFRESH CONCURRENTLY têm idx_<resumo> sem UNIQUE: ele é recriado
+    cur.execute("SELECT indisunique FROM pg_index WHERE indexrelid = to_regclass(%s)", (f"idx_{nome}",))
+    linha = cur.fetchone()
+    if linha is not None and not linha[0]:
+        cur.execute(f"DROP INDEX idx_{nome}")
+    cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{nome} ON {nome} {chave}")
+    if indice:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{nome}_ordem ON {nome} {indice}")
+
+
+def atualizar_resumos(config):
+    # Cria os resumos que ainda não existem e atualiza os demais com REFRESH CONCURRENTLY,
+    # que não bloqueia as leituras do dashboard. Tudo numa transação: os quatro resumos
+    # e a geração da carga mudam juntos, com um único incremento da geração no final
+    try:
+        with psycopg2.connect(**config) as conn:
+            with conn.cursor() as cur:
+                for nome, query, chave, indice in RESUMOS:
+                    start_time = time.time()
+                    cur.execute("SELECT 1 FROM pg_matviews WHERE matviewname = %s", (nome,))
+                    if cur.fetchone():
+                        indexar_resumo(cur, nome, chave, indice)
+                        cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {nome}")
+                    else:
+                        cur.execute(f"CREATE MATERIALIZED VIEW {nome} AS {query}")
+                        indexar_resumo(cur, nome, chave, indice)
+                    cur.execute(f"ANALYZE {nome}")
+                    print(f"Resumo {nome} atualizado em {time.time() - start_time:.2f} segundos.")
+                # As consultas de ranking do dashboard leem os resumos
+                incrementar_geracao(cur)
+            conn.commit()
+
+    except (psycopg2.DatabaseError, Exception) as error:
+        print(f"Erro ao atualizar resumos: {error}")
+
+
+class Avaliacoes:
+    # Avaliações de um produto em colunas: data (date.toordinal), nota, votos e úteis
+    # em arrays de inteiros e só os códigos dos clientes (tupla) como objetos Python
+    __slots__ = ('datas', 'clientes', 'ratings', 'votes', 'helpful')
+
+    def __init__(self, detalhes=()):
+        # Cada coluna é criada de uma vez, sem a sobra de capacidade dos append()
+        colunas = list(zip(*detalhes)) or [(), (), (), (), ()]
+        self.datas = array('i', colunas[0])
+        self.clientes = colunas[1]
+        self.ratings = array('i', colunas[2])
+        self.votes = array('i', colunas[3])
+        self.helpful = array('i', colunas[4])
+
+    def __len__(self):
+        return len(self.datas)
+
+    def __iter__(self):
+        # (data, cliente, nota, votos, úteis), com a data já como datetime.date
+        for i in range(len(self.datas)):
+            yield (datetime.date.fromordinal(self.datas[i]), self.clientes[i],
+                   self.ratings[i], self.votes[i], self.helpful[i])
+
+    def __repr__(self):
+        return (f"Avaliacoes(datas={self.datas.tolist()}, clientes={list(self.clientes)}, ratings={self.ratings.tolist()}, "
+                f"votes={self.votes.tolist()}, helpful={self.helpful.tolist()})")
+
+
+class Produto(NamedTuple):
+    # Um registro do arquivo. Produtos descontinuados só têm id e asin.
+    id: int
+    asin: str
+    title: Optional[str] = None
+    group: Optional[str] = None
+    salesrank: Optional[int] = None
+    similares: Tuple[str, ...] = ()
+    categorias: Tuple[Tuple[str, ...], ...] = ()
+    reviews: Optional[Tuple[int, int, float]] = None
+    avaliacoes: Optional[Avaliacoes] = None
+
+
+def novo_produto():
+    # Campos lidos do registro atual, antes de virar um Produto
+    return {
+        'id': [],
+        'asin': [],
+        'title': [],
+        'group': [],
+        'salesrank': [],
+        'similar': [],
+        'categories': [],
+        'reviews': [],
+        'reviews_details': [],
+    }
+
+
+def _primeiro(valores):
+    return valores[0] if valores else None
+
+
+def montar_produto(campos):
+    return Produto(
+        campos['id'][0],
+        _primeiro(campos['asin']),
+        _primeiro(campos['title']),
+        _primeiro(campos['group']),
+        _primeiro(campos['salesrank']),
+        tuple(_primeiro(campos['similar']) or ()),
+        tuple(tuple(caminho) for caminho in campos['categories']),
+        tuple(campos['reviews']) if campos['reviews'] else None,
+        Avaliacoes(campos['reviews_details']) if campos['reviews_details'] else None,
+    )
+
+
+def _reviews(valor):
+    # "total: 2  downloaded: 2  avg rating: 5"
+    parts = valor.split()
+    return [int(parts[1]), int(parts[3]), float(parts[6])]
+
+
+# Campo do produto e conversão do valor para cada chave "chave: valor" do arquivo;
+# a linha "categories: N" só anuncia os caminhos que vêm depois e é ignorada
+CAMPOS = {
+    'Id': ('id', int),
+    'ASIN': ('asin', str),
+    'title': ('title', str),
+    'group': ('group', str),
+    'salesrank': ('salesrank', int),
+    'similar': ('similar', lambda valor: valor.split()[1:]),
+    'reviews': ('reviews', _reviews),
+}
+
+
+def tokenizar(arquivo):
+    # Classifica cada linha uma única vez, pelo primeiro caractere não branco, e devolve
+    # (campo, valor) já convertido. Linha em branco devolve (None, None): fim do registro.
+    for linha in arquivo:
+        texto = linha.strip()
+        if not texto:
+            yield None, None
+            continue
+        inicio = texto[0]
+        if inicio == "|":
+            yield 'categories', [item.strip() for item in texto.split("|") if item]
+        elif inicio.isdigit():
+            # "2000-7-28  cutomer: A2JW67OY8U6HHK  rating: 5  votes:  10  helpful:   9"
+            parts = texto.split()
+            ano, mes, dia = parts[0].split("-")
+            # data (ordinal), cliente, nota, votos, úteis
+            yield 'reviews_details', (datetime.date(int(ano), int(mes), int(dia)).toordinal(),
+                                      parts[2], int(parts[4]), int(parts[6]), int(parts[8]))
+        else:
+            chave, _, valor = texto.partition(":")
+            campo = CAMPOS.get(chave)
+            if campo:
+                yield campo[0], campo[1](valor.strip())
+
 
 def extrair_itens(arquivo):
-    conteudo = arquivo.readlines()
-    id = []
-    asin = []
-    title = []
-    group = []
-    salesrank = []
-    similar = []
-    categories = []
-    reviews = []
-    reviews_details = []
-    produto = {}
-    produtos = []
-    for i in tqdm(range(3, len(conteudo)), desc="Extraindo itens"):
-        if conteudo[i].startswith("Id:"):
-            id.append(conteudo[i].split("Id:")[1].strip())
-        elif conteudo[i].startswith("ASIN:"):
-            asin.append(conteudo[i].split("ASIN:")[1].strip())
-        elif conteudo[i].strip().startswith("title:"):
-            title.append(conteudo[i].split("title:")[1].strip())
-        elif conteudo[i].strip().startswith("group:"):
-            group.append(conteudo[i].split("group:")[1].strip())
-        elif conteudo[i].strip().startswith("salesrank:"):
-            salesrank.append(conteudo[i].split("salesrank:")[1].strip())
-        elif conteudo[i].strip().startswith("similar:"):
-            similar.append(conteudo[i].split("similar:")[1].strip().split()[1:])
-        elif conteudo[i].strip().startswith("categories:"):
-            categories1 = []
-        elif conteudo[i].strip().startswith("|"):
-                lista = conteudo[i].strip()
-                lista = lista.split("|")
-                lista = [item.strip() for item in lista if item]  
-                categories.append(lista)
-        elif conteudo[i].strip().startswith("reviews:"): 
-            parts = conteudo[i].split()
-
-            total_index = parts.index('total:') + 1
-            downloaded_index = parts.index('downloaded:') + 1
-            avg_rating_index = parts.index('avg') + 2 
-
-            total = int(parts[total_index])
-            downloaded = int(parts[downloaded_index])
-            avg_rating = float(parts[avg_rating_index])
-            reviews.append(total)
-            reviews.append(downloaded)
-            reviews.append(avg_rating)
-        elif conteudo[i].lstrip()[:4].isdigit():
-            reviews_details1 = []
-            parts = conteudo[i].split()
-            date = parts[0]
-            customer_code = parts[2]
-            rating = int(parts[4])
-            votes = int(parts[6])
-            helpful = int(parts[8])
-            reviews_details1.append(date)
-            reviews_details1.append(customer_code)
-            reviews_details1.append(rating)
-            reviews_details1.append(votes)
-            reviews_details1.append(helpful)
-            reviews_details.append(reviews_details1)
-
-        
-        if conteudo[i].strip() == "" or i == len(conteudo)-1:
-            produto = {
-                'id': id,
-                'asin': asin,
-                'title': title,
-                'group': group,
-                'salesrank': salesrank,
-                'similar': similar,
-                'categories': categories,
-                'reviews': reviews,
-                'reviews_details': reviews_details,
-            }
-            produtos.append(produto)
-            id = []
-            asin = []
-            title = []
-            group = []
-            salesrank = []
-            similar = []
-            categories = []
-            reviews = []
-            reviews_details = []
-    return produtos
-
-
-def inserir_bd(produtos, config):
-    all_products_data = []
-    all_similar_products_data = []
-    all_review_details_data = []
-    all_customer_ids = set()
-    all_category_data = []
-    all_product_category_data = []
-
-    for produto in tqdm(produtos, desc="Processando produtos"):
-        product_data = products(produto, config)
-        all_products_data.extend(product_data)
-
-        # Coletar produtos similares
-        similar_data = similar(produto, config)
-        all_similar_products_data.extend(similar_data)
-
-        # Coletar detalhes das avaliações e IDs dos clientes
-        review_data, customer_ids = reviews(produto, config)
-        all_review_details_data.extend(review_data)
-        all_customer_ids.update(customer_ids)
-
-        # Coletar categorias
-        category_data = category(produto, config)
-        all_category_data.extend(category_data)
-
-        # Coletar associações entre produtos e categorias
-        product_category_data = prodcategory(produto, config)
-        all_product_category_data.extend(product_category_data)
-
-    
-    insert_query = """
-        INSERT INTO produtos (product_id, asin, title, product_group, salesrank, review_total, review_downloaded, review_avg)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (product_id) DO NOTHING;
-    """
+    # Gerador: lê o arquivo linha a linha e devolve um produto por vez,
+    # assim a memória fica limitada ao maior registro e não ao tamanho do arquivo
+    campos = novo_produto()
+    for campo, valor in tokenizar(arquivo):
+        if campo is None:
+            # Linha em branco separa os registros; o cabeçalho do arquivo não tem Id e é descartado
+            if campos['id']:
+                yield montar_produto(campos)
+            campos = novo_produto()
+        elif campo == 'reviews':
+            campos['reviews'].extend(valor)
+        else:
+            campos[campo].append(valor)
 
-    insert_similar_query = """
-        INSERT INTO produtos_similares (product_asin, similar_asin)
-        VALUES (%s, %s)
-        ON CONFLICT (product_asin, similar_asin) DO NOTHING;
-    """
+    if campos['id']:
+        yield montar_produto(campos)
 
-    insert_review_query = """
-        INSERT INTO avaliacoes (product_id, review_date, customer_id, rating, votes, helpful)
-        VALUES (%s, %s, %s, %s, %s, %s)
-        ON CONFLICT (product_id, customer_id, review_date) DO NOTHING;
-    """
+TAMANHO_BLOCO = 8 * 2**20
+
+
+def dividir_arquivo(caminho, tamanho_bloco=TAMANHO_BLOCO, inicio=0):
+    # Divide o arquivo, a partir do byte inicio, em faixas de ~tamanho_bloco bytes, cada
+    # uma terminando logo após uma linha em branco, para que nenhum registro fique partido
+    tamanho = os.path.getsize(caminho)
+    fronteiras = [inicio]
+    with open(caminho, "rb") as f:
+        pos = inicio + tamanho_bloco
+        while pos < tamanho:
+            f.seek(pos)
+            f.readline()  # descarta o restante da linha onde caiu o seek
+            linha = f.readline()
+            while linha and linha.strip():
+                linha = f.readline()
+            pos = f.tell()
+            if pos >= tamanho:
+                break
+            fronteiras.append(pos)
+            pos += tamanho_bloco
+    fronteiras.append(tamanho)
+    return list(zip(fronteiras, fronteiras[1:]))
+
+
+def _extrair_bloco(bloco):
+    caminho, inicio, fim = bloco
+    with open(caminho, "rb") as f:
+        f.seek(inicio)
+        dados = f.read(fim - inicio)
+    produtos = list(extrair_itens(io.StringIO(dados.decode("utf8"))))
+    # Só o último produto da faixa tem a posição seguinte conhecida: o fim da faixa
+    return [(produto, None) for produto in produtos[:-1]] + [(produto, fim) for produto in produtos[-1:]]
 
-    insert_cliente_query = """
-        INSERT INTO cliente (customer_id)
-        VALUES (%s)
-        ON CONFLICT (customer_id) DO NOTHING;
-    """
 
-    insert_category_query = """
-        INSERT INTO categoria (category_id, name, parent_id)
-        VALUES (%s, %s, %s)
-        ON CONFLICT (category_id) DO NOTHING;
+def extrair_itens_paralelo(caminho, workers, tamanho_bloco=TAMANHO_BLOCO, inicio=0):
+    # Cada faixa é processada por extrair_itens num processo separado e os produtos
+    # voltam na ordem do arquivo. No máximo 2 * workers faixas ficam em andamento,
+    # então a memória continua limitada mesmo se a gravação for mais lenta.
+    blocos = [(caminho, i, fim) for i, fim in dividir_arquivo(caminho, tamanho_bloco, inicio)]
+    with multiprocessing.Pool(workers) as pool:
+        pendentes = collections.deque()
+        for bloco in blocos:
+            pendentes.append(pool.apply_async(_extrair_bloco, (bloco,)))
+            if len(pendentes) >= 2 * workers:
+                yield from pendentes.popleft().get()
+        while pendentes:
+            yield from pendentes.popleft().get()
+
+
+class LeitorPosicionado:
+    # Lê o arquivo em modo binário e mantém em posicao o byte logo após a última linha lida
+    def __init__(self, arquivo, inicio=0):
+        self.arquivo = arquivo
+        self.arquivo.seek(inicio)
+        self.posicao = inicio
+
+    def __iter__(self):
+        for linha in self.arquivo:
+            self.posicao += len(linha)
+            yield linha.decode("utf8")
+
+
+def ler_arquivo(caminho, workers=1, inicio=0):
+    # Produtos do arquivo a partir do byte inicio, cada um com a posição logo após o
+    # registro (None quando ainda não é conhecida, no meio de uma faixa da leitura paralela)
+    if workers > 1:
+        yield from extrair_itens_paralelo(caminho, workers, inicio=inicio)
+        return
+    with open(caminho, "rb") as arquivo:
+        leitor = LeitorPosicionado(arquivo, inicio)
+        for produto in extrair_itens(leitor):
+            yield produto, leitor.posicao
+
+# Tabelas na ordem de inserção: colunas, chave de conflito e descrição usada nas mensagens
+TABELAS = (
+    ('produtos', ('product_id', 'asin', 'title', 'product_group', 'salesrank', 'review_total', 'review_downloaded', 'review_avg'),
+     ('product_id',), "produtos"),
+    ('produtos_similares', ('product_id', 'similar_id'),
+     ('product_id', 'similar_id'), "produtos similares"),
+    ('similares_pendentes', ('product_id', 'similar_asin'),
+     ('product_id', 'similar_asin'), "similares fora do arquivo"),
+    ('cliente', ('customer_id', 'customer_code'),
+     ('customer_id',), "dados dos clientes"),
+    ('avaliacoes', ('product_id', 'review_date', 'customer_id', 'rating', 'votes', 'helpful'),
+     ('product_id', 'customer_id', 'review_date'), "detalhes dos reviews"),
+    ('categoria', ('category_id', 'name', 'parent_id'),
+     ('category_id',), "categorias"),
+    ('produto_categoria', ('product_id', 'category_id'),
+     ('product_id', 'category_id'), "associações entre produtos e categorias"),
+    ('produto_hash', ('product_id', 'hash'),
+     ('product_id',), "impressões digitais dos produtos"),
+)
+
+TAMANHO_LOTE = 10000
+MODOS = ('copy', 'executemany')
+
+
+def acao_conflito(colunas, conflito, atualizar=False):
+    # DO NOTHING na carga normal; na carga delta as linhas existentes são sobrescritas
+    if not atualizar:
+        return "DO NOTHING"
+    return "DO UPDATE SET " + ", ".join(f"{c} = EXCLUDED.{c}" for c in colunas if c not in conflito)
+
+
+def query_insercao(tabela, colunas, conflito, atualizar=False):
+    return f"""
+        INSERT INTO {tabela} ({', '.join(colunas)})
+        VALUES ({', '.join(['%s'] * len(colunas))})
+        ON CONFLICT ({', '.join(conflito)}) {acao_conflito(colunas, conflito, atualizar)};
     """
 
-    insert_product_category_query = """
-        INSERT INTO produto_categoria (product_id, category_id)
-        VALUES (%s, %s)
-        ON CONFLICT (product_id, category_id) DO NOTHING;
+
+def query_mesclagem(tabela, colunas, conflito, atualizar=False, sufixo=""):
+    # Passa as linhas da tabela de staging para a tabela real numa única instrução
+    return f"""
+        INSERT INTO {tabela} ({', '.join(colunas)})
+        SELECT {', '.join(colunas)} FROM stg_{tabela}{sufixo}
+        ON CONFLICT ({', '.join(conflito)}) {acao_conflito(colunas, conflito, atualizar)};
     """
-    print("INSERINDO OS VALORES NAS TABELAS")
+
+
+def criar_staging(cur, tabelas=None, sufixo=""):
+    # Tabelas UNLOGGED sem índices que recebem o COPY antes da mesclagem. Escritores
+    # paralelos da mesma tabela usam cada um a sua staging, com um sufixo no nome.
+    for tabela, _, _, _ in TABELAS:
+        if tabelas is not None and tabela not in tabelas:
+            continue
+        cur.execute(f"CREATE UNLOGGED TABLE IF NOT EXISTS stg_{tabela}{sufixo} (LIKE {tabela})")
+        cur.execute(f"TRUNCATE stg_{tabela}{sufixo}")
+
+
+def formatar_copy(valor):
+    # Formato texto do COPY: \N para nulo e escape de barra, tab e quebras de linha
+    if valor is None:
+        return "\\N"
+    return str(valor).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def buffer_copy(dados):
+    buffer = io.StringIO()
+    for linha in dados:
+        buffer.write("\t".join(map(formatar_copy, linha)))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+def copiar_direto(cur, tabela, colunas, dados):
+    # Carga rápida: COPY direto na tabela, que ainda não tem chaves para o ON CONFLICT
+    cur.copy_expert(f"COPY {tabela} ({', '.join(colunas)}) FROM STDIN", buffer_copy(dados))
+
+
+def copiar_tabela(cur, tabela, colunas, conflito, dados, atualizar=False, sufixo=""):
+    cur.copy_expert(f"COPY stg_{tabela}{sufixo} ({', '.join(colunas)}) FROM STDIN", buffer_copy(dados))
+    cur.execute(query_mesclagem(tabela, colunas, conflito, atualizar, sufixo))
+    cur.execute(f"TRUNCATE stg_{tabela}{sufixo}")
+
+
+def novo_lote():
+    return {tabela: [] for tabela, _, _, _ in TABELAS}
+
+
+def impressao_digital(produto):
+    # Hash do registro lido, em hexadecimal, comparado com produto_hash na carga delta
+    return hashlib.blake2b(repr(produto).encode("utf8"), digest_size=16).hexdigest()
+
+
+def transformar(produto, lote, arvore, asins, clientes, config, digital=None):
+    lote['produtos'].extend(products(produto, config))
+    # Formato hexadecimal de entrada do bytea
+    lote['produto_hash'].append((produto.id, "\\x" + (digital or impressao_digital(produto))))
+
+    # Coletar produtos similares como pares de ids; um ASIN ainda não lido vai para
+    # similares_pendentes e é resolvido no fim da carga por resolver_similares
+    asins[produto.asin] = produto.id
+    for product_id, similar_asin in similar(produto, config):
+        similar_id = asins.get(similar_asin)
+        if similar_id is None:
+            lote['similares_pendentes'].append((product_id, similar_asin))
+        else:
+            lote['produtos_similares'].append((product_id, similar_id))
+
+    # Coletar detalhes das avaliações e os clientes vistos pela primeira vez
+    review_data, customer_data = reviews(produto, config, clientes)
+    lote['avaliacoes'].extend(review_data)
+    lote['cliente'].extend(customer_data)
+
+    # Coletar categorias novas e as folhas dos caminhos do produto
+    category_data, folhas = category(produto, arvore)
+    lote['categoria'].extend(category_data)
+
+    # Coletar associações entre produtos e categorias
+    lote['produto_categoria'].extend(prodcategory(produto, folhas))
+
+
+def gravar_tabela(cur, definicao, dados, estatisticas, modo='copy', atualizar=False, sufixo="", propagar=False):
+    # Com propagar o erro também é relançado, para quem chamou não confirmar o lote
+    tabela, colunas, conflito, descricao = definicao
+    if not dados:
+        return
+    start_time = time.time()
+    try:
+        if modo == 'copy':
+            copiar_tabela(cur, tabela, colunas, conflito, dados, atualizar, sufixo)
+        elif modo == 'direto':
+            copiar_direto(cur, tabela, colunas, dados)
+        else:
+            cur.executemany(query_insercao(tabela, colunas, conflito, atualizar), dados)
+        estatisticas[tabela][0] += len(dados)
+        estatisticas[tabela][1] += time.time() - start_time
+    except Exception as e:
+        print(f"Erro ao inserir {descricao}: {e}")
+        if propagar:
+            raise
+
+
+def gravar_lote(cur, lote, estatisticas, modo='copy', atualizar=()):
+    # atualizar: tabelas cujas linhas existentes são sobrescritas (carga delta)
+    for definicao in TABELAS:
+        gravar_tabela(cur, definicao, lote[definicao[0]], estatisticas, modo, definicao[0] in atualizar)
+
+
+def preparar_lote(cur, produtos, arvore, asins, clientes, config, delta=None):
+    # Transforma os produtos do lote nas linhas de cada tabela. Na carga delta (delta é o
+    # dicionário de contagens) só entram os produtos novos ou cuja impressão digital mudou;
+    # as avaliações, similares e categorias dos alterados são apagadas para serem regravadas.
+    lote = novo_lote()
+    digitais = [impressao_digital(produto) for produto in produtos]
+    if delta is None:
+        for produto, digital in zip(produtos, digitais):
+            transformar(produto, lote, arvore, asins, clientes, config, digital)
+        return lote
+
+    cur.execute("SELECT product_id, hash FROM produto_hash WHERE product_id = ANY(%s)",
+                ([produto.id for produto in produtos],))
+    existentes = {product_id: bytes(digital).hex() for product_id, digital in cur.fetchall()}
+    alterados = []
+    for produto, digital in zip(produtos, digitais):
+        anterior = existentes.get(produto.id)
+        if anterior == digital:
+            delta['inalterados'] += 1
+            continue
+        if anterior is None:
+            delta['novos'] += 1
+        else:
+            delta['alterados'] += 1
+            alterados.append(produto.id)
+        transformar(produto, lote, arvore, asins, clientes, config, digital)
+
+    if alterados:
+        cur.execute("DELETE FROM avaliacoes WHERE product_id = ANY(%s)", (alterados,))
+        cur.execute("DELETE FROM produto_categoria WHERE product_id = ANY(%s)", (alterados,))
+        cur.execute("DELETE FROM produtos_similares WHERE product_id = ANY(%s)", (alterados,))
+        cur.execute("DELETE FROM similares_pendentes WHERE product_id = ANY(%s)", (alterados,))
+    return lote
+
+
+def carregar_asins(cur):
+    # ASIN -> product_id dos produtos já gravados, para a carga delta e a retomada
+    # resolverem similares que apontam para produtos de cargas anteriores
+    cur.execute("SELECT asin, product_id FROM produtos")
+    return dict(cur.fetchall())
+
+
+def carregar_clientes(cur):
+    # Clientes já gravados, para toda carga continuar a numeração de cliente
+    cur.execute("SELECT customer_code, customer_id FROM cliente")
+    return Clientes(cur.fetchall())
+
+
+def resolver_similares(cur):
+    # Similares pendentes cujo ASIN foi gravado depois (mais adiante no arquivo ou por outro
+    # escritor) viram pares de ids; os que sobram são ASINs que não estão no arquivo
+    cur.execute("""
+        INSERT INTO produtos_similares (product_id, similar_id)
+        SELECT DISTINCT sp.product_id, p.product_id
+        FROM similares_pendentes sp
+        JOIN produtos p ON p.asin = sp.similar_asin
+        WHERE NOT EXISTS (
+            SELECT 1 FROM produtos_similares s
+            WHERE s.product_id = sp.product_id AND s.similar_id = p.product_id
+        )
+    """)
+    resolvidos = cur.rowcount
+    cur.execute("DELETE FROM similares_pendentes sp USING produtos p WHERE p.asin = sp.similar_asin")
+    cur.execute("SELECT count(*) FROM similares_pendentes")
+    pendentes = cur.fetchone()[0]
+    print(f"Similares: {resolvidos} resolvidos no fim da carga, {pendentes} ASINs fora do arquivo em similares_pendentes.")
+    return resolvidos, pendentes
+
+
+def ler_checkpoint(config, caminho):
+    # Byte a partir do qual a carga deste arquivo deve continuar (0 se não houver checkpoint
+    # ou se o conteúdo do arquivo mudou desde então). O checkpoint é do nome do arquivo, então
+    # o tamanho e o hash confirmam que é o mesmo arquivo; o hash só é calculado se o tamanho bater
     with psycopg2.connect(**config) as conn:
         with conn.cursor() as cur:
-           
-            if all_products_data:
-                start_time = time.time()
-                try:
-                    cur.executemany(insert_query, all_products_data)
-                    elapsed_time = time.time() - start_time
-                    print(f"Inserção de produtos concluída com sucesso em {elapsed_time:.2f} segundos.")
-                except Exception as e:
-                    print(f"Erro ao inserir produtos: {e}")
+            cur.execute("SELECT tamanho, hash, byte_offset, ultimo_id FROM carga_controle WHERE arquivo = %s",
+                        (os.path.basename(caminho),))
+            checkpoint = cur.fetchone()
+    if not checkpoint:
+        return 0
+    tamanho, digest, posicao, ultimo_id = checkpoint
+    if tamanho != os.path.getsize(caminho) or digest != hash_arquivo(caminho):
+        print(f"O checkpoint de {os.path.basename(caminho)} é de outro arquivo com o mesmo nome, "
+              f"a carga recomeça do início.")
+        return 0
+    print(f"Retomando a carga no byte {posicao} (último produto gravado: {ultimo_id}).")
+    return posicao
 
-            
-            if all_similar_products_data:
-                start_time = time.time()
-                try:
-                    cur.executemany(insert_similar_query, all_similar_products_data)
-                    elapsed_time = time.time() - start_time
-                    print(f"Inserção de produtos similares concluída com sucesso em {elapsed_time:.2f} segundos.")
-                except Exception as e:
-                    print(f"Erro ao inserir produtos similares: {e}")
 
-            
-            if all_review_details_data:
-                start_time = time.time()
-                try:
-                    cur.executemany(insert_review_query, all_review_details_data)
-                    elapsed_time = time.time() - start_time
-                    print(f"Inserção de detalhes dos reviews concluída com sucesso em {elapsed_time:.2f} segundos.")
-                except Exception as e:
-                    print(f"Erro ao inserir detalhes dos reviews: {e}")
+def registrar_checkpoint(cur, caminho, posicao, ultimo_id):
+    cur.execute("""
+        INSERT INTO carga_controle (arquivo, tamanho, hash, byte_offset, ultimo_id, atualizado_em)
+        VALUES (%s, %s, %s, %s, %s, now())
+        ON CONFLICT (arquivo) DO UPDATE
+        SET tamanho = EXCLUDED.tamanho, hash = EXCLUDED.hash, byte_offset = EXCLUDED.byte_offset,
+            ultimo_id = EXCLUDED.ultimo_id, atualizado_em = EXCLUDED.atualizado_em;
+    """, (os.path.basename(caminho), os.path.getsize(caminho), hash_arquivo(caminho), posicao, ultimo_id))
 
-            
-            if all_customer_ids:
-                start_time = time.time()
-                try:
-                    cur.executemany(insert_cliente_query, [(customer_id,) for customer_id in all_customer_ids])
-                    elapsed_time = time.time() - start_time
-                    print(f"Inserção de dados dos clientes concluída com sucesso em {elapsed_time:.2f} segundos.")
-                except Exception as e:
-                    print(f"Erro ao inserir dados dos clientes: {e}")
 
-            
-            if all_category_data:
-                start_time = time.time()
-                try:
-                    cur.executemany(insert_category_query, all_category_data)
-                    elapsed_time = time.time() - start_time
-                    print(f"Inserção de categorias concluída com sucesso em {elapsed_time:.2f} segundos.")
-                except Exception as e:
-                    print(f"Erro ao inserir categorias: {e}")
+def incrementar_geracao(cur):
+    # Confirmada junto com os dados: cada nova geração invalida os resultados guardados
+    # no cache de consultas do tp1_3.3.py
+    cur.execute("""
+        INSERT INTO carga_geracao (id, geracao) VALUES (TRUE, 1)
+        ON CONFLICT (id) DO UPDATE
+        SET geracao = carga_geracao.geracao + 1, atualizado_em = now();
+    """)
 
-            
-            if all_product_category_data:
-                start_time = time.time()
-                try:
-                    cur.executemany(insert_product_category_query, all_product_category_data)
-                    elapsed_time = time.time() - start_time
-                    print(f"Inserção de associações entre produtos e categorias concluída com sucesso em {elapsed_time:.2f} segundos.")
-                except Exception as e:
-                    print(f"Erro ao inserir associações entre produtos e categorias: {e}")
+
+def imprimir_tabelas(estatisticas):
+    for tabela, _, _, descricao in TABELAS:
+        linhas, segundos = estatisticas[tabela]
+        taxa = linhas / segundos if segundos else 0.0
+        print(f"Inserção de {descricao} concluída: {linhas} linhas em {segundos:.2f} segundos ({taxa:.0f} linhas/s).")
+
+
+def imprimir_estatisticas(estatisticas, arvore):
+    imprimir_tabelas(estatisticas)
+    print(f"Categorias: {arvore.segmentos} segmentos nos caminhos, {len(arvore.pais)} categorias distintas gravadas.")
+    # Antes cada segmento de cada caminho virava uma linha em produto_categoria
+    print(f"Associações produto-categoria: {arvore.segmentos} linhas no método antigo, "
+          f"{estatisticas['produto_categoria'][0]} folhas distintas enviadas.")
+
+
+def nova_contagem_delta():
+    return {'novos': 0, 'alterados': 0, 'inalterados': 0}
+
+
+def inserir_bd(produtos, config, tamanho_lote=TAMANHO_LOTE, modo='copy', checkpoint=None, delta=None):
+    # Consome os pares (produto, posição) como um fluxo: transforma e grava em lotes de
+    # tamanho_lote, sem acumular o arquivo inteiro na memória. No modo 'copy' cada tabela
+    # vai por COPY para a staging e é mesclada de uma vez; 'executemany' é o caminho antigo.
+    # Com checkpoint (o caminho do arquivo) cada lote é confirmado junto com a posição
+    # no arquivo e o último Id gravados em carga_controle; sem ele há um único commit no final.
+    # Com delta (as contagens de nova_contagem_delta, preenchidas aqui) só os produtos novos
+    # ou alterados desde a última carga são regravados.
+    estatisticas = {tabela: [0, 0.0] for tabela, _, _, _ in TABELAS}
+    arvore = ArvoreCategorias()
+    contagem_delta = delta
+    atualizar = ('produtos', 'produto_hash') if delta is not None else ()
+    lote = []
+    n_lote = 0
+    n_lotes = 0
+    inicio_lote = time.time()
+
+    print("INSERINDO OS VALORES NAS TABELAS")
+    with psycopg2.connect(**config) as conn:
+        with conn.cursor() as cur:
+            if modo == 'copy':
+                criar_staging(cur)
+            asins = carregar_asins(cur) if checkpoint is not None or delta is not None else {}
+            clientes = carregar_clientes(cur)
+
+            barra = tqdm(produtos, desc="Processando produtos")
+            for produto, posicao in barra:
+                lote.append(produto)
+                n_lote += 1
+                # Na leitura paralela a posição só é conhecida no fim de cada faixa
+                if n_lote >= tamanho_lote and (checkpoint is None or posicao is not None):
+                    gravar_lote(cur, preparar_lote(cur, lote, arvore, asins, clientes, config, contagem_delta), estatisticas, modo, atualizar)
+                    if checkpoint is not None:
+                        registrar_checkpoint(cur, checkpoint, posicao, produto.id)
+                        incrementar_geracao(cur)
+                        conn.commit()
+                        n_lotes += 1
+                        segundos = time.time() - inicio_lote
+                        barra.write(f"Lote {n_lotes}: {n_lote} produtos em {segundos:.2f} segundos "
+                                    f"({n_lote / segundos:.0f} produtos/s), checkpoint no byte {posicao}.")
+                        inicio_lote = time.time()
+                    lote = []
+                    n_lote = 0
+
+            if n_lote:
+                gravar_lote(cur, preparar_lote(cur, lote, arvore, asins, clientes, config, contagem_delta), estatisticas, modo, atualizar)
+                if checkpoint is not None:
+                    registrar_checkpoint(cur, checkpoint, os.path.getsize(checkpoint), produto.id)
+            resolver_similares(cur)
+            incrementar_geracao(cur)
 
         conn.commit()
 
+    imprimir_estatisticas(estatisticas, arvore)
+    if delta is not None:
+        print(f"Delta: {contagem_delta['novos']} produtos novos, {contagem_delta['alterados']} alterados, "
+              f"{contagem_delta['inalterados']} inalterados.")
+
+    return estatisticas
+
+
+
+# Tabelas cujos lotes só podem ser gravados depois que o mesmo lote destas já foi
+# confirmado, por causa das chaves estrangeiras
+DEPENDENCIAS = {
+    'produtos_similares': ('produtos',),
+    'similares_pendentes': ('produtos',),
+    'avaliacoes': ('produtos', 'cliente'),
+    'produto_categoria': ('produtos', 'categoria'),
+    'produto_hash': ('produtos',),
+}
+# Tabela dividida entre vários escritores com --writers, por product_id % N
+TABELA_PARTICIONADA = 'avaliacoes'
+PROFUNDIDADE_FILA = 4
+INTERVALO_MONITOR = 5.0
 
- 
 
+class Estagio:
+    # Contadores de um estágio do pipeline e a fila de onde ele lê (None para a leitura)
+    def __init__(self, nome, fila=None):
+        self.nome = nome
+        self.fila = fila
+        self.itens = 0
+        self.ocupado = 0.0
+        self.profundidades = []
 
 
+class Progresso:
+    # Último lote confirmado por escritor; os escritores esperam aqui pelas tabelas de que dependem
+    def __init__(self, escritores):
+        self.condicao = threading.Condition()
+        self.confirmado = {escritor: -1 for escritor in escritores}
+
+    def esperar(self, tabelas, seq):
+        with self.condicao:
+            self.condicao.wait_for(lambda: all(self.confirmado[t] >= seq for t in tabelas))
+
+    def confirmar(self, tabela, seq):
+        with self.condicao:
+            self.confirmado[tabela] = seq
+            self.condicao.notify_all()
+
+
+def _estagio_leitura(produtos, tamanho_lote, saida, estagio, erros):
+    try:
+        seq = 0
+        lote = []
+        inicio = time.time()
+        for produto, _ in produtos:
+            if erros:
+                # Outro estágio falhou: para de ler, as filas só recebem o fim
+                lote = []
+                break
+            lote.append(produto)
+            if len(lote) >= tamanho_lote:
+                estagio.ocupado += time.time() - inicio
+                saida.put((seq, lote))
+                estagio.itens += 1
+                seq += 1
+                lote = []
+                inicio = time.time()
+        if lote:
+            estagio.ocupado += time.time() - inicio
+            saida.put((seq, lote))
+            estagio.itens += 1
+    except Exception as e:
+        erros.append(e)
+    finally:
+        saida.put(None)
+
+
+def _estagio_transformacao(entrada, saidas, arvore, config, estagio, erros):
+    # Um único transformador: a árvore de categorias e os dicionários de ASINs e de
+    # clientes dependem da ordem dos produtos
+    asins = {}
+    falhou = False
+    try:
+        with psycopg2.connect(**config) as conn:
+            with conn.cursor() as cur:
+                clientes = carregar_clientes(cur)
+        conn.close()
+    except Exception as e:
+        erros.append(e)
+        falhou = True
+    while True:
+        item = entrada.get()
+        if item is None:
+            break
+        if falhou or erros:
+            continue  # continua esvaziando a fila para a leitura não travar
+        seq, produtos = item
+        try:
+            inicio = time.time()
+            lote = preparar_lote(None, produtos, arvore, asins, clientes, config)
+            particoes = [nome for nome in saidas if nome.startswith(TABELA_PARTICIONADA + "_")]
+            if particoes:
+                # product_id é a primeira coluna; um produto fica sempre no mesmo escritor,
+                # então dois escritores nunca disputam a mesma chave primária
+                fatias = [[] for _ in particoes]
+                for linha in lote.pop(TABELA_PARTICIONADA):
+                    fatias[linha[0] % len(particoes)].append(linha)
+                lote.update(zip(particoes, fatias))
+            estagio.ocupado += time.time() - inicio
+            estagio.itens += 1
+            for nome, fila in saidas.items():
+                fila.put((seq, lote[nome]))
+        except Exception as e:
+            erros.append(e)
+            falhou = True
+    for fila in saidas.values():
+        fila.put(None)
+
+
+def _estagio_escrita(definicao, entrada, config, modo, progresso, estatisticas, estagio, erros, nome=None):
+    # nome identifica o escritor quando a tabela é dividida entre vários (ex.: avaliacoes_2)
+    tabela = definicao[0]
+    nome = nome or tabela
+    sufixo = nome[len(tabela):]
+    item = ()
+    try:
+        with psycopg2.connect(**config) as conn:
+            with conn.cursor() as cur:
+                if modo == 'copy':
+                    criar_staging(cur, (tabela,), sufixo)
+                    conn.commit()
+                while True:
+                    item = entrada.get()
+                    if item is None:
+                        break
+                    seq, dados = item
+                    progresso.esperar(DEPENDENCIAS.get(tabela, ()), seq)
+                    if erros:
+                        # Outro estágio falhou: a carga não será concluída, só esvazia a fila
+                        continue
+                    inicio = time.time()
+                    gravar_tabela(cur, definicao, dados, estatisticas, modo, sufixo=sufixo, propagar=True)
+                    conn.commit()
+                    estagio.ocupado += time.time() - inicio
+                    estagio.itens += 1
+                    progresso.confirmar(nome, seq)
+    except Exception as e:
+        erros.append(e)
+    finally:
+        # Libera os escritores que dependem desta tabela mesmo se ela falhou, e continua
+        # esvaziando a fila para a transformação não travar
+        progresso.confirmar(nome, float("inf"))
+        while item is not None:
+            item = entrada.get()
+
+
+def _monitorar(estagios, parar):
+    while not parar.wait(INTERVALO_MONITOR):
+        partes = []
+        for estagio in estagios:
+            if estagio.fila is not None:
+                profundidade = estagio.fila.qsize()
+                estagio.profundidades.append(profundidade)
+                partes.append(f"{estagio.nome} {profundidade}/{estagio.fila.maxsize}")
+        print("Filas: " + " | ".join(partes))
+
+
+def inserir_bd_pipeline(produtos, config, tamanho_lote=TAMANHO_LOTE, modo='copy', escritores_avaliacoes=1):
+    # Leitura, transformação e um escritor por tabela rodam ao mesmo tempo, ligados por
+    # filas limitadas (PROFUNDIDADE_FILA lotes): o banco recebe dados enquanto o arquivo
+    # ainda está sendo lido e um estágio lento segura os anteriores em vez de acumular memória.
+    # Com escritores_avaliacoes > 1 a tabela avaliacoes, a maior, é dividida por product_id
+    # entre esse número de escritores, cada um com sua conexão e sua staging.
+    estatisticas = {tabela: [0, 0.0] for tabela, _, _, _ in TABELAS}
+    arvore = ArvoreCategorias()
+    erros = []
+
+    # (nome do escritor, definição da tabela)
+    definicoes = []
+    for definicao in TABELAS:
+        if definicao[0] == TABELA_PARTICIONADA and escritores_avaliacoes > 1:
+            definicoes.extend((f"{definicao[0]}_{i}", definicao) for i in range(escritores_avaliacoes))
+        else:
+            definicoes.append((definicao[0], definicao))
+    progresso = Progresso(nome for nome, _ in definicoes)
+    # Cada escritor soma nas suas próprias estatísticas; no fim elas são somadas por tabela
+    parciais = {nome: {definicao[0]: [0, 0.0]} for nome, definicao in definicoes}
+
+    fila_produtos = queue.Queue(PROFUNDIDADE_FILA)
+    filas = {nome: queue.Queue(PROFUNDIDADE_FILA) for nome, _ in definicoes}
+    leitura = Estagio("leitura")
+    transformacao = Estagio("transformação", fila_produtos)
+    escritores = {nome: Estagio(nome, filas[nome]) for nome in filas}
+    estagios = [leitura, transformacao] + list(escritores.values())
+
+    threads = [
+        threading.Thread(target=_estagio_leitura, args=(produtos, tamanho_lote, fila_produtos, leitura, erros)),
+        threading.Thread(target=_estagio_transformacao, args=(fila_produtos, filas, arvore, config, transformacao, erros)),
+    ]
+    for nome, definicao in definicoes:
+        threads.append(threading.Thread(target=_estagio_escrita, args=(
+            definicao, filas[nome], config, modo, progresso, parciais[nome], escritores[nome], erros, nome)))
+
+    print("INSERINDO OS VALORES NAS TABELAS (pipeline)")
+    inicio = time.time()
+    parar = threading.Event()
+    monitor = threading.Thread(target=_monitorar, args=(estagios, parar), daemon=True)
+    monitor.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    parar.set()
+    total = time.time() - inicio
+
+    for nome, definicao in definicoes:
+        linhas, segundos = parciais[nome][definicao[0]]
+        estatisticas[definicao[0]][0] += linhas
+        estatisticas[definicao[0]][1] += segundos
+
+    # Os similares pendentes só podem ser resolvidos depois que todos os lotes de
+    # produtos foram gravados, então a resolução roda quando os escritores terminam
+    if not erros:
+        with psycopg2.connect(**config) as conn:
+            with conn.cursor() as cur:
+                resolver_similares(cur)
+                incrementar_geracao(cur)
+            conn.commit()
+
+    for erro in erros:
+        print(f"Erro no pipeline: {erro}")
+    imprimir_estatisticas(estatisticas, arvore)
+
+    print(f"\nPipeline concluído em {total:.2f} segundos, {len(definicoes)} escritores.")
+    print(f"{'Estágio':<22} {'Lotes':<7} {'Ocupado (s)':<12} {'Lotes/s':<9} {'Fila média':<11} {'Fila máx':<8}")
+    print("=" * 72)
+    for estagio in estagios:
+        taxa = estagio.itens / estagio.ocupado if estagio.ocupado else 0.0
+        if estagio.profundidades:
+            media = f"{sum(estagio.profundidades) / len(estagio.profundidades):.1f}"
+            maximo = str(max(estagio.profundidades))
+        else:
+            media = maximo = "-"
+        print(f"{estagio.nome:<22} {estagio.itens:<7} {estagio.ocupado:<12.2f} {taxa:<9.2f} {media:<11} {maximo:<8}")
+
+    if erros:
+        # Os lotes confirmados antes do erro continuam gravados, mas a carga está incompleta
+        raise RuntimeError(f"pipeline interrompido por {len(erros)} erro(s), a carga está incompleta")
+    return estatisticas
+
+# Cache binário: um arquivo por tabela no formato binário do COPY do PostgreSQL,
+# lido por mmap e enviado direto para a staging, sem passar pelo parser de texto
+VERSAO_CACHE = 1
+MANIFESTO_CACHE = "manifesto.json"
+TIPOS_CACHE = {
+    'produtos': ('int', 'texto', 'texto', 'texto', 'int', 'int', 'int', 'float'),
+    'produtos_similares': ('int', 'int'),
+    'similares_pendentes': ('int', 'texto'),
+    'cliente': ('int', 'texto'),
+    'avaliacoes': ('int', 'data', 'int', 'int', 'int', 'int'),
+    'categoria': ('int', 'texto', 'int'),
+    'produto_categoria': ('int', 'int'),
+    'produto_hash': ('int', 'bytea'),
+}
+# O formato binário guarda datas como dias desde 2000-01-01
+EPOCA_PG = datetime.date(2000, 1, 1).toordinal()
+CABECALHO_PGCOPY = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+NULO_PGCOPY = struct.pack(">i", -1)
+
+
+def _texto_binario(valor):
+    dados = valor.encode("utf8")
+    return struct.pack(">i", len(dados)) + dados
+
+
+def _bytea_binario(valor):
+    # transformar() gera o bytea no formato hexadecimal de entrada ("\\x...")
+    dados = bytes.fromhex(valor[2:])
+    return struct.pack(">i", len(dados)) + dados
+
+
+CODIFICADORES = {
+    'int': lambda valor: struct.pack(">ii", 4, valor),
+    'float': lambda valor: struct.pack(">id", 8, valor),
+    'data': lambda valor: struct.pack(">ii", 4, valor.toordinal() - EPOCA_PG),
+    'texto': _texto_binario,
+    'bytea': _bytea_binario,
+}
+
+
+def codificar_linhas(tabela, linhas):
+    # Linhas de uma tabela no formato binário do COPY (sem cabeçalho e terminador)
+    codificadores = [CODIFICADORES[tipo] for tipo in TIPOS_CACHE[tabela]]
+    n_campos = struct.pack(">h", len(codificadores))
+    partes = []
+    for linha in linhas:
+        partes.append(n_campos)
+        for codificar, valor in zip(codificadores, linha):
+            partes.append(NULO_PGCOPY if valor is None else codificar(valor))
+    return b"".join(partes)
+
+
+# Hashes já calculados, por (caminho, tamanho, mtime): o checkpoint de cada lote e o
+# cache não leem o arquivo inteiro de novo
+_hashes = {}
+
+
+def hash_arquivo(caminho):
+    origem = os.stat(caminho)
+    chave = (os.path.abspath(caminho), origem.st_size, origem.st_mtime_ns)
+    if chave not in _hashes:
+        resumo = hashlib.blake2b(digest_size=16)
+        with open(caminho, "rb") as f:
+            for bloco in iter(lambda: f.read(2**20), b""):
+                resumo.update(bloco)
+        _hashes[chave] = resumo.hexdigest()
+    return _hashes[chave]
+
+
+def cache_valido(pasta, caminho):
+    # O cache vale se foi gerado pela mesma versão a partir de um arquivo com o mesmo
+    # tamanho, mtime e conteúdo; o hash só é calculado se tamanho e mtime baterem
+    try:
+        with open(os.path.join(pasta, MANIFESTO_CACHE), "r", encoding="utf8") as f:
+            manifesto = json.load(f)
+    except (OSError, ValueError):
+        return False
+    origem = os.stat(caminho)
+    if (manifesto.get('versao') != VERSAO_CACHE or manifesto.get('tamanho') != origem.st_size
+            or manifesto.get('mtime_ns') != origem.st_mtime_ns):
+        return False
+    if not all(os.path.exists(os.path.join(pasta, f"{tabela}.pgcopy")) for tabela in TIPOS_CACHE):
+        return False
+    return manifesto.get('hash') == hash_arquivo(caminho)
+
+
+def gerar_cache(caminho, pasta, workers=1, tamanho_lote=TAMANHO_LOTE):
+    # Lê e transforma o arquivo uma vez, gravando as linhas de cada tabela no cache.
+    # O manifesto é escrito por último: um cache interrompido no meio fica inválido.
+    os.makedirs(pasta, exist_ok=True)
+    manifesto = os.path.join(pasta, MANIFESTO_CACHE)
+    if os.path.exists(manifesto):
+        os.remove(manifesto)
+    origem = os.stat(caminho)
+    arvore = ArvoreCategorias()
+    asins = {}
+    clientes = Clientes()
+    linhas = {tabela: 0 for tabela in TIPOS_CACHE}
+    arquivos = {tabela: open(os.path.join(pasta, f"{tabela}.pgcopy"), "wb") for tabela in TIPOS_CACHE}
+    try:
+        for arquivo in arquivos.values():
+            arquivo.write(CABECALHO_PGCOPY)
+
+        def gravar(lote):
+            for tabela, arquivo in arquivos.items():
+                arquivo.write(codificar_linhas(tabela, lote[tabela]))
+                linhas[tabela] += len(lote[tabela])
+
+        lote = novo_lote()
+        n_lote = 0
+        for produto, _ in tqdm(ler_arquivo(caminho, workers), desc="Gerando cache"):
+            transformar(produto, lote, arvore, asins, clientes, config)
+            n_lote += 1
+            if n_lote >= tamanho_lote:
+                gravar(lote)
+                lote = novo_lote()
+                n_lote = 0
+        if n_lote:
+            gravar(lote)
+
+        for arquivo in arquivos.values():
+            arquivo.write(struct.pack(">h", -1))
+    finally:
+        for arquivo in arquivos.values():
+            arquivo.close()
+
+    with open(manifesto + ".tmp", "w", encoding="utf8") as f:
+        json.dump({'versao': VERSAO_CACHE, 'arquivo': os.path.abspath(caminho), 'tamanho': origem.st_size,
+                   'mtime_ns': origem.st_mtime_ns, 'hash': hash_arquivo(caminho), 'linhas': linhas}, f, indent=2)
+    os.replace(manifesto + ".tmp", manifesto)
+    return linhas
+
+
+def remapear_clientes(cur):
+    # Os ids de cliente do cache são numerados a partir de 1, sem olhar o banco. Os
+    # códigos que já estão em cliente ficam com o id gravado e os novos continuam a
+    # numeração; o mapa (id do cache -> id do banco) é aplicado à staging de cliente aqui
+    # e à de avaliacoes em aplicar_mapa_clientes. Devolve False se o mapa for a identidade
+    # (banco sem clientes), e aí nada precisa ser reescrito.
+    cur.execute("""
+        CREATE TEMP TABLE mapa_clientes ON COMMIT DROP AS
+        SELECT s.customer_id AS id_cache,
+               COALESCE(c.customer_id, (SELECT COALESCE(MAX(customer_id), 0) FROM cliente)
+                        + ROW_NUMBER() OVER (PARTITION BY c.customer_id IS NULL ORDER BY s.customer_id)) AS id_banco
+        FROM stg_cliente s
+        LEFT JOIN cliente c ON c.customer_code = s.customer_code
+    """)
+    cur.execute("SELECT EXISTS (SELECT 1 FROM mapa_clientes WHERE id_cache <> id_banco)")
+    if not cur.fetchone()[0]:
+        return False
+    cur.execute("ANALYZE mapa_clientes")
+    cur.execute("""
+        UPDATE stg_cliente s SET customer_id = m.id_banco
+        FROM mapa_clientes m WHERE m.id_cache = s.customer_id
+    """)
+    return True
+
+
+def aplicar_mapa_clientes(cur):
+    cur.execute("""
+        UPDATE stg_avaliacoes a SET customer_id = m.id_banco
+        FROM mapa_clientes m WHERE m.id_cache = a.customer_id
+    """)
+
+
+def carregar_cache(pasta, config):
+    # Cada arquivo do cache é mapeado na memória e enviado inteiro por COPY binário
+    # para a staging, depois mesclado na tabela real; um único commit no final
+    estatisticas = {tabela: [0, 0.0] for tabela, _, _, _ in TABELAS}
+    remapear = False
+    print("INSERINDO OS VALORES NAS TABELAS A PARTIR DO CACHE")
+    with psycopg2.connect(**config) as conn:
+        with conn.cursor() as cur:
+            criar_staging(cur)
+            for tabela, colunas, conflito, descricao in TABELAS:
+                start_time = time.time()
+                try:
+                    with open(os.path.join(pasta, f"{tabela}.pgcopy"), "rb") as f, \
+                            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as dados:
+                        cur.copy_expert(f"COPY stg_{tabela} ({', '.join(colunas)}) FROM STDIN WITH (FORMAT binary)", dados)
+                    linhas = cur.rowcount
+                    # cliente vem antes de avaliacoes em TABELAS
+                    if tabela == 'cliente':
+                        remapear = remapear_clientes(cur)
+                    elif tabela == 'avaliacoes' and remapear:
+                        aplicar_mapa_clientes(cur)
+                    cur.execute(query_mesclagem(tabela, colunas, conflito))
+                    cur.execute(f"TRUNCATE stg_{tabela}")
+                    estatisticas[tabela][0] += linhas
+                    estatisticas[tabela][1] += time.time() - start_time
+                except Exception as e:
+                    print(f"Erro ao inserir {descricao}: {e}")
+                    conn.rollback()
+                    return estatisticas
+            resolver_similares(cur)
+            incrementar_geracao(cur)
+        conn.commit()
+
+    imprimir_tabelas(estatisticas)
+    return estatisticas
+
 
 config = {
     'dbname': 'xxxxx',
@@ -414,9 +1506,75 @@ config = {
     'port': 'xxxxx'
         }
 
-arquivo = open("amazon-meta.txt", "r", encoding="utf8")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Carrega o amazon-meta.txt no PostgreSQL")
+    parser.add_argument("arquivo", nargs="?", default="amazon-meta.txt", help="arquivo de entrada (padrão: amazon-meta.txt)")
+    parser.add_argument("--lote", type=int, default=TAMANHO_LOTE, help="produtos gravados por lote")
+    parser.add_argument("--workers", type=int, default=1, help="processos usados na leitura do arquivo (padrão: 1, leitura serial)")
+    parser.add_argument("--fechamento", action="store_true", help="cria a tabela categoria_fechamento com os ancestrais de cada categoria")
+    parser.add_argument("--sem-indices", action="store_true",
+                        help="não cria os índices secundários das consultas depois da carga")
+    parser.add_argument("--modo", choices=MODOS, default='copy', help="copy (padrão) ou executemany, o caminho antigo")
+    parser.add_argument("--retomavel", action="store_true",
+                        help="confirma cada lote com um checkpoint em carga_controle e retoma dele numa nova execução")
+    parser.add_argument("--reiniciar", action="store_true", help="com --retomavel, ignora o checkpoint e lê o arquivo desde o início")
+    parser.add_argument("--delta", action="store_true",
+                        help="carga incremental: só grava produtos novos ou alterados desde a última carga")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="leitura, transformação e um escritor por tabela em paralelo, ligados por filas limitadas")
+    parser.add_argument("--writers", type=int, default=1,
+                        help="com --pipeline, escritores paralelos da tabela avaliacoes, divididos por product_id (padrão: 1)")
+    parser.add_argument("--rapida", action="store_true",
+                        help="carga rápida: tabelas UNLOGGED sem restrições, que são criadas e validadas depois da carga")
+    parser.add_argument("--cache", metavar="PASTA",
+                        help="carrega a partir do cache binário em PASTA, gerando-o antes se faltar ou estiver desatualizado")
+    parser.add_argument("--atualizar-resumos", action="store_true", help="só atualiza os resumos materializados do dashboard, sem carregar o arquivo")
+    args = parser.parse_args()
+    if args.pipeline and (args.retomavel or args.delta):
+        parser.error("--pipeline não pode ser combinado com --retomavel ou --delta")
+    if args.writers > 1 and not args.pipeline:
+        parser.error("--writers só vale com --pipeline")
+    if args.rapida and (args.retomavel or args.delta or args.cache):
+        parser.error("--rapida não pode ser combinado com --retomavel, --delta ou --cache")
+    if args.cache and (args.pipeline or args.retomavel or args.delta):
+        parser.error("--cache não pode ser combinado com --pipeline, --retomavel ou --delta")
 
-produtos = extrair_itens(arquivo)
-criar_tabelas(config)
-inserir_bd(produtos,config)
-print("FINALIZADO")
+    if args.atualizar_resumos:
+        # Garante carga_geracao em bancos criados antes dela
+        criar_tabelas(config)
+        atualizar_resumos(config)
+    else:
+        if args.rapida and tabelas_existentes(config):
+            parser.error("--rapida exige um banco sem as tabelas da carga: " + ", ".join(tabelas_existentes(config)))
+        criar_tabelas(config, args.rapida)
+        # A carga rápida grava direto nas tabelas, sem staging nem ON CONFLICT
+        modo = 'direto' if args.rapida else args.modo
+        inicio = 0
+        contagem_delta = nova_contagem_delta() if args.delta else None
+        if args.retomavel and not args.reiniciar:
+            inicio = ler_checkpoint(config, args.arquivo)
+        if args.cache:
+            if cache_valido(args.cache, args.arquivo):
+                print(f"Cache em {args.cache} válido, leitura do arquivo de texto dispensada.")
+            else:
+                gerar_cache(args.arquivo, args.cache, args.workers, args.lote)
+            carregar_cache(args.cache, config)
+        elif args.pipeline:
+            try:
+                inserir_bd_pipeline(ler_arquivo(args.arquivo, args.workers), config, args.lote, modo, args.writers)
+            except RuntimeError as e:
+                # Sem índices nem resumos sobre uma carga incompleta
+                sys.exit(f"Erro na carga: {e}")
+        else:
+            inserir_bd(ler_arquivo(args.arquivo, args.workers, inicio), config, args.lote, modo,
+                       args.arquivo if args.retomavel else None, contagem_delta)
+        if args.rapida:
+            finalizar_carga_rapida(config)
+        if args.fechamento:
+            criar_fechamento(config)
+        if not args.sem_indices:
+            criar_indices(config)
+        # Sempre, também depois de uma carga delta: os rankings por grupo e as médias por
+        # categoria mudam com qualquer produto alterado, e a geração já foi incrementada
+        atualizar_resumos(config)
+    print("FINALIZADO")
@@ -1,53 +1,50 @@
+import argparse
+import atexit
+import collections
+import concurrent.futures
+import hashlib
+import itertools
+import os
+import pickle
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2 import pool
 from typing import Iterable, Any
 from typing import List, Tuple
 
-def lista_5(product_id: Any, config) -> Iterable[Any]:
-    # Consulta SQL para selecionar os 5 comentários mais úteis com maior e menor avaliação
-    query = """
+# Consultas do dashboard. São preparadas no servidor (PREPARE) uma vez por conexão
+# do pool; os parâmetros usam a notação $1 do PREPARE. As consultas c, e, f e g leem
+# os resumos materializados mantidos pela carga (RESUMOS no tp1_3.2.py).
+CONSULTAS = {
+    # 5 comentários mais úteis com maior e com menor avaliação
+    'lista_5': ("integer", """
         (
-        SELECT produtos.product_id, produtos.asin, avaliacoes.customer_id, avaliacoes.review_date, avaliacoes.rating, avaliacoes.helpful 
-        FROM produtos, avaliacoes 
-        WHERE produtos.product_id=%s
-        ORDER BY rating DESC, helpful DESC 
+        SELECT p.product_id, p.asin, c.customer_code, a.review_date, a.rating, a.helpful
+        FROM avaliacoes a
+        INNER JOIN produtos p ON p.product_id = a.product_id
+        INNER JOIN cliente c ON c.customer_id = a.customer_id
+        WHERE a.product_id = $1
+        ORDER BY a.rating DESC, a.helpful DESC
         LIMIT 5
         )
-        UNION ALL 
+        UNION ALL
         (
-        SELECT produtos.product_id, produtos.asin, avaliacoes.customer_id, avaliacoes.review_date, avaliacoes.rating, avaliacoes.helpful 
-        FROM produtos, avaliacoes 
-        WHERE produtos.product_id=%s
-        ORDER BY rating ASC, helpful DESC
+        SELECT p.product_id, p.asin, c.customer_code, a.review_date, a.rating, a.helpful
+        FROM avaliacoes a
+        INNER JOIN produtos p ON p.product_id = a.product_id
+        INNER JOIN cliente c ON c.customer_id = a.customer_id
+        WHERE a.product_id = $1
+        ORDER BY a.rating ASC, a.helpful DESC
         LIMIT 5
-        );
-    """
-    
-    # Inicializa o gerenciador de banco de dados
-    
-    try:
-        # Obter as configurações de conexão
-
-        # Conectar ao banco de dados
-        conn = psycopg2.connect(**config)
-        cur = conn.cursor()
-
-        # Executar a consulta
-        cur.execute(query, (product_id, product_id))
-        result = cur.fetchall()
-
-        # Fechar a conexão
-        cur.close()
-        conn.close()
-
-        # Retornar o resultado
-        return result
-    except Exception as error:
-        print(f"Erro ao executar a consulta: {error}")
-        return None
-
-def listar_mais_vendidos(config) -> List[Tuple[str, int, str]]:
-    # Consulta SQL para listar os 10 produtos mais vendidos por grupo
-    query = """
+        )
+    """),
+    # 10 produtos mais vendidos por grupo
+    'listar_mais_vendidos': (None, """
     SELECT title, salesrank, product_group 
     FROM (
         SELECT title, salesrank, product_group, 
@@ -55,83 +52,436 @@ def listar_mais_vendidos(config) -> List[Tuple[str, int, str]]:
         FROM produtos 
         WHERE salesrank > 0
     ) rs 
-    WHERE Rank <= 10;
-    """
-    
+    WHERE Rank <= 10
+    """),
+    # Produtos similares com melhores vendas
+    'listar_similares_maiores_vendas': ("integer", """
+    SELECT psimilar.title, psimilar.salesrank
+    FROM produtos p
+    JOIN produtos_similares sp ON sp.product_id = p.product_id
+    JOIN produtos psimilar ON psimilar.product_id = sp.similar_id
+    WHERE p.product_id = $1
+    AND psimilar.salesrank < p.salesrank
+    """),
+    # Média das avaliações por data
+    'evolucao_medias_avaliacao': ("integer", """
+    SELECT p.title, m.review_date, m.avg_rating
+    FROM resumo_media_diaria m
+    INNER JOIN produtos p ON p.product_id = m.product_id
+    WHERE m.product_id = $1
+    ORDER BY m.review_date ASC
+    """),
+    # 10 principais clientes por grupo
+    'listar_clientes': (None, """
+    SELECT c.customer_code, r.n_reviews, r.review_rank, r.product_group
+    FROM resumo_clientes_grupo r
+    INNER JOIN cliente c ON c.customer_id = r.customer_id
+    WHERE r.review_rank <= 10
+    ORDER BY r.product_group ASC, r.review_rank ASC
+    """),
+    # 5 principais categorias
+    'listar_categorias': (None, """
+    SELECT c.name, ROUND(r.avg_helpful, 2)
+    FROM resumo_categoria r
+    INNER JOIN categoria c ON c.category_id = r.category_id
+    WHERE r.avg_helpful > 0
+    ORDER BY r.avg_helpful DESC
+    LIMIT 5
+    """),
+    # 10 produtos com maior média de avaliações úteis por grupo
+    'listar_produtos': (None, """
+    SELECT h.product_id, p.title, h.product_group, h.avg_helpful, h.n_rank
+    FROM resumo_helpful_produto h
+    INNER JOIN produtos p ON p.product_id = h.product_id
+    WHERE h.n_rank <= 10
+    ORDER BY h.product_group ASC, h.n_rank ASC
+    """),
+    # A categoria e todas as suas descendentes
+    'subarvore_categoria': ("integer", """
+    WITH RECURSIVE sub AS (
+        SELECT category_id, name, parent_id, 0 AS nivel
+        FROM categoria
+        WHERE category_id = $1
+        UNION ALL
+        SELECT c.category_id, c.name, c.parent_id, sub.nivel + 1
+        FROM categoria c
+        INNER JOIN sub ON c.parent_id = sub.category_id
+    )
+    SELECT category_id, name, parent_id, nivel
+    FROM sub
+    ORDER BY nivel, name
+    """),
+    # O caminho da raiz até a categoria
+    'ancestrais_categoria': ("integer", """
+    WITH RECURSIVE anc AS (
+        SELECT category_id, name, parent_id, 0 AS distancia
+        FROM categoria
+        WHERE category_id = $1
+        UNION ALL
+        SELECT c.category_id, c.name, c.parent_id, anc.distancia + 1
+        FROM categoria c
+        INNER JOIN anc ON c.category_id = anc.parent_id
+    )
+    SELECT category_id, name, distancia
+    FROM anc
+    ORDER BY distancia DESC
+    """),
+}
+
+# Versões em lote das consultas a, b e c: uma consulta para uma lista de produtos ($1 é
+# um integer[]). A primeira coluna (produto) é o produto, e as linhas vêm ordenadas por ele.
+# Ficam fora de CONSULTAS, cujas consultas recebem no máximo um id
+CONSULTAS_LOTE = {
+    'lista_5_lote': ("integer[]", """
+    SELECT r.product_id AS produto, r.product_id, r.asin, r.customer_code, r.review_date, r.rating, r.helpful
+    FROM (
+        SELECT p.product_id, p.asin, c.customer_code, a.review_date, a.rating, a.helpful,
+               ROW_NUMBER() OVER (PARTITION BY a.product_id ORDER BY a.rating DESC, a.helpful DESC) AS maior,
+               ROW_NUMBER() OVER (PARTITION BY a.product_id ORDER BY a.rating ASC, a.helpful DESC) AS menor
+        FROM avaliacoes a
+        INNER JOIN produtos p ON p.product_id = a.product_id
+        INNER JOIN cliente c ON c.customer_id = a.customer_id
+        WHERE a.product_id = ANY($1)
+    ) r
+    CROSS JOIN (VALUES (1), (2)) AS lado (n)
+    WHERE (lado.n = 1 AND r.maior <= 5) OR (lado.n = 2 AND r.menor <= 5)
+    ORDER BY r.product_id, lado.n, CASE lado.n WHEN 1 THEN r.maior ELSE r.menor END
+    """),
+    'listar_similares_maiores_vendas_lote': ("integer[]", """
+    SELECT p.product_id AS produto, psimilar.title, psimilar.salesrank
+    FROM produtos p
+    JOIN produtos_similares sp ON sp.product_id = p.product_id
+    JOIN produtos psimilar ON psimilar.product_id = sp.similar_id
+    WHERE p.product_id = ANY($1)
+    AND psimilar.salesrank < p.salesrank
+    ORDER BY p.product_id
+    """),
+    'evolucao_medias_avaliacao_lote': ("integer[]", """
+    SELECT m.product_id AS produto, p.title, m.review_date, m.avg_rating
+    FROM resumo_media_diaria m
+    INNER JOIN produtos p ON p.product_id = m.product_id
+    WHERE m.product_id = ANY($1)
+    ORDER BY m.product_id, m.review_date ASC
+    """),
+}
+
+# As opções do menu e a consulta de cada uma
+OPCOES = {
+    'a': 'lista_5',
+    'b': 'listar_similares_maiores_vendas',
+    'c': 'evolucao_medias_avaliacao',
+    'd': 'listar_mais_vendidos',
+    'e': 'listar_produtos',
+    'f': 'listar_categorias',
+    'g': 'listar_clientes',
+    'h': 'subarvore_categoria',
+    'i': 'ancestrais_categoria',
+}
+
+# Relatórios completos (sem filtro de produto ou de ranking), lidos com cursor no servidor
+# ou página a página. Para cada um, a consulta sem ORDER BY e a chave que ordena e identifica
+# as linhas, como (expressão, posição da coluna no SELECT); a chave segue o índice do resumo
+RELATORIOS = {
+    # Média diária das avaliações de todos os produtos
+    'evolucao_medias_avaliacao': ("""
+    SELECT m.product_id, p.title, m.review_date, m.avg_rating
+    FROM resumo_media_diaria m
+    INNER JOIN produtos p ON p.product_id = m.product_id
+    """, (("m.product_id", 0), ("m.review_date", 2))),
+    # Ranking completo de clientes por grupo, posição a posição
+    'listar_clientes': ("""
+    SELECT c.customer_code, r.n_reviews, r.review_rank, r.product_group
+    FROM resumo_clientes_grupo r
+    INNER JOIN cliente c ON c.customer_id = r.customer_id
+    """, (("r.review_rank", 2), ("r.product_group", 3))),
+}
+# Linhas trazidas do servidor por vez pelos cursores nomeados
+ITERSIZE = 2000
+TAMANHO_PAGINA = 20
+
+TAMANHO_POOL = 5
+# Conexões paradas há mais que isso são testadas com SELECT 1 antes de serem usadas
+VERIFICAR_APOS = 30.0
+
+_pools = {}
+_preparadas = {}
+_ultimo_uso = {}
+# As exportações começam juntas em várias threads; sem a trava cada uma poderia criar o
+# seu pool para a mesma configuração e as conexões dos pools perdidos ficariam abertas
+_trava_pools = threading.Lock()
+
+
+def obter_pool(config):
+    # Um pool por configuração, com no máximo TAMANHO_POOL conexões
+    chave = tuple(sorted(config.items()))
+    with _trava_pools:
+        if chave not in _pools:
+            _pools[chave] = pool.ThreadedConnectionPool(1, TAMANHO_POOL, **config)
+        return _pools[chave]
+
+
+@atexit.register
+def fechar_pools():
+    with _trava_pools:
+        for p in _pools.values():
+            p.closeall()
+        _pools.clear()
+    _preparadas.clear()
+    _ultimo_uso.clear()
+
+
+def _saudavel(conn):
+    if conn.closed or conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if time.monotonic() - _ultimo_uso[conn] < VERIFICAR_APOS:
+        return True
     try:
-        # Conectar ao banco de dados
-        conn = psycopg2.connect(**config)
-        cur = conn.cursor()
-
-        # Executar a consulta
-        cur.execute(query)
-        result = cur.fetchall()
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        return True
+    except psycopg2.Error:
+        return False
+
+
+@contextmanager
+def conexao(config):
+    # Empresta uma conexão do pool; conexões que caíram são descartadas e trocadas
+    p = obter_pool(config)
+    conn = p.getconn()
+    # Conexões recém-abertas pelo pool ainda não estão em _preparadas e não precisam de teste
+    while conn in _preparadas and not _saudavel(conn):
+        _preparadas.pop(conn, None)
+        _ultimo_uso.pop(conn, None)
+        p.putconn(conn, close=True)
+        conn = p.getconn()
+    if conn not in _preparadas:
+        conn.autocommit = True
+        _preparadas[conn] = set()
+    fechar = False
+    try:
+        yield conn
+    except psycopg2.OperationalError:
+        fechar = True
+        raise
+    finally:
+        _ultimo_uso[conn] = time.monotonic()
+        if fechar:
+            _preparadas.pop(conn, None)
+            _ultimo_uso.pop(conn, None)
+        p.putconn(conn, close=fechar)
+
+
+def executar(cur, nome, params=()):
+    # Executa a consulta preparada nome, preparando-a nesta conexão na primeira vez
+    preparadas = _preparadas[cur.connection]
+    if nome not in preparadas:
+        tipo, query = CONSULTAS[nome]
+        tipos = f" ({tipo})" if tipo else ""
+        cur.execute(f"PREPARE {nome}{tipos} AS {query}")
+        preparadas.add(nome)
+    if params:
+        cur.execute(f"EXECUTE {nome} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f"EXECUTE {nome}")
+
+
+# Consultas de ranking: o resultado só muda com uma nova carga, então vão para o cache
+CACHEAVEIS = ('listar_mais_vendidos', 'listar_clientes', 'listar_categorias', 'listar_produtos')
+TAMANHO_CACHE = 128
+# Pasta do cache em disco, para os resultados valerem entre execuções do menu
+# (ex.: ".cache_consultas"); None mantém só o cache em memória
+PASTA_CACHE = None
+
+
+class CacheResultados:
+    # LRU em memória (e opcionalmente em disco) de (banco, consulta, parâmetros) -> linhas,
+    # com a geração da carga em que o resultado foi calculado; outra geração invalida a entrada
+    def __init__(self, tamanho=TAMANHO_CACHE, pasta=PASTA_CACHE):
+        self.tamanho = tamanho
+        self.pasta = pasta
+        self.entradas = collections.OrderedDict()
+        self.trava = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.economizado = 0.0
+
+    def _arquivo(self, chave):
+        return os.path.join(self.pasta, hashlib.sha1(repr(chave).encode("utf8")).hexdigest() + ".pickle")
+
+    def _memoria(self, chave, entrada):
+        with self.trava:
+            self.entradas[chave] = entrada
+            self.entradas.move_to_end(chave)
+            while len(self.entradas) > self.tamanho:
+                self.entradas.popitem(last=False)
+
+    def obter(self, chave, geracao):
+        # (linhas, segundos que a consulta levou) ou None se não houver entrada desta geração
+        with self.trava:
+            entrada = self.entradas.get(chave)
+            if entrada is not None and entrada[0] == geracao:
+                self.entradas.move_to_end(chave)
+                return entrada[1], entrada[2]
+        if self.pasta is None:
+            return None
+        try:
+            with open(self._arquivo(chave), "rb") as f:
+                entrada = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if entrada[0] != geracao:
+            return None
+        self._memoria(chave, entrada)
+        return entrada[1], entrada[2]
+
+    def guardar(self, chave, geracao, linhas, segundos):
+        entrada = (geracao, linhas, segundos)
+        self._memoria(chave, entrada)
+        if self.pasta is not None:
+            os.makedirs(self.pasta, exist_ok=True)
+            arquivo = self._arquivo(chave)
+            temporario = f"{arquivo}.{os.getpid()}.{threading.get_ident()}"
+            with open(temporario, "wb") as f:
+                pickle.dump(entrada, f)
+            os.replace(temporario, arquivo)
+
+    def registrar(self, acerto, economizado=0.0):
+        with self.trava:
+            if acerto:
+                self.acertos += 1
+                self.economizado += economizado
+            else:
+                self.falhas += 1
+
+    def relatorio(self):
+        total = self.acertos + self.falhas
+        return {'acertos': self.acertos, 'falhas': self.falhas,
+                'taxa_acerto': self.acertos / total if total else 0.0, 'economizado_s': self.economizado}
+
+
+cache = CacheResultados()
+
+
+def geracao_carga(cur):
+    # Geração da última carga (carga_geracao, incrementada pelo tp1_3.2.py); None se o
+    # banco ainda não tem a tabela, e aí o cache não é usado
+    try:
+        cur.execute("SELECT geracao FROM carga_geracao")
+    except psycopg2.errors.UndefinedTable:
+        return None
+    linha = cur.fetchone()
+    return linha[0] if linha else 0
+
+
+def consultar(config, nome, params=()):
+    with conexao(config) as conn:
+        with conn.cursor() as cur:
+            if nome not in CACHEAVEIS:
+                executar(cur, nome, params)
+                return cur.fetchall()
+
+            inicio = time.perf_counter()
+            geracao = geracao_carga(cur)
+            chave = (config.get('host'), config.get('port'), config.get('dbname'), nome, tuple(params))
+            encontrado = cache.obter(chave, geracao) if geracao is not None else None
+            if encontrado is not None:
+                linhas, custo = encontrado
+                cache.registrar(True, custo - (time.perf_counter() - inicio))
+                return list(linhas)
+            executar(cur, nome, params)
+            linhas = cur.fetchall()
+            if geracao is not None:
+                cache.guardar(chave, geracao, linhas, time.perf_counter() - inicio)
+            cache.registrar(False)
+            return list(linhas)
+
+
+def notacao_psycopg(query):
+    # Troca os parâmetros $1, $2... do PREPARE por %(p1)s, %(p2)s... do psycopg2, para as
+    # consultas que não podem ser preparadas (DECLARE e COPY não aceitam EXECUTE)
+    return re.sub(r"\$(\d+)", r"%(p\1)s", query)
+
+
+def consultar_por_produto(config, nome, product_ids, itersize=ITERSIZE):
+    # Executa a consulta em lote nome para todos os product_ids de uma vez e devolve,
+    # à medida que lê, (product_id, linhas) de cada produto que teve resultado; as linhas
+    # têm as mesmas colunas da consulta de um produto só. Como em iterar_relatorio, as
+    # linhas vêm itersize por vez de um cursor nomeado
+    with conexao(config) as conn:
+        conn.autocommit = False
+        try:
+            with conn.cursor(name=f"lote_{nome}") as cur:
+                cur.itersize = itersize
+                cur.execute(notacao_psycopg(CONSULTAS_LOTE[nome][1]), {'p1': list(product_ids)})
+                for product_id, linhas in itertools.groupby(cur, key=lambda linha: linha[0]):
+                    yield product_id, [linha[1:] for linha in linhas]
+        finally:
+            conn.rollback()
+            conn.autocommit = True
+
+
+def iterar_relatorio(config, nome, itersize=ITERSIZE):
+    # Todas as linhas do relatório, trazidas itersize por vez por um cursor nomeado
+    # (DECLARE/FETCH no servidor): a memória do cliente não cresce com o resultado.
+    # A conexão fica emprestada do pool até o gerador terminar ou ser fechado
+    query, chave = RELATORIOS[nome]
+    ordem = ", ".join(expressao for expressao, _ in chave)
+    with conexao(config) as conn:
+        # Cursores nomeados só existem dentro de uma transação
+        conn.autocommit = False
+        try:
+            with conn.cursor(name=f"relatorio_{nome}") as cur:
+                cur.itersize = itersize
+                cur.execute(f"{query} ORDER BY {ordem}")
+                yield from cur
+        finally:
+            conn.rollback()
+            conn.autocommit = True
+
+
+def pagina_relatorio(config, nome, depois=None, tamanho=TAMANHO_PAGINA):
+    # Uma página do relatório por paginação de chave: as linhas depois da chave depois
+    # (None na primeira página), sem OFFSET, então a página 1000 custa o mesmo que a
+    # primeira. Devolve as linhas e a chave da próxima página (None na última)
+    query, chave = RELATORIOS[nome]
+    colunas = ", ".join(expressao for expressao, _ in chave)
+    filtro = f"WHERE ({colunas}) > ({', '.join(['%s'] * len(chave))})" if depois is not None else ""
+    with conexao(config) as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"{query} {filtro} ORDER BY {colunas} LIMIT %s", (*(depois or ()), tamanho))
+            linhas = cur.fetchall()
+    proxima = tuple(linhas[-1][posicao] for _, posicao in chave) if len(linhas) == tamanho else None
+    return linhas, proxima
 
-        # Fechar a conexão
-        cur.close()
-        conn.close()
 
-        # Retornar o resultado
-        return result
+def lista_5(product_id: Any, config) -> Iterable[Any]:
+    # Consulta SQL para selecionar os 5 comentários mais úteis com maior e menor avaliação
+    try:
+        return consultar(config, 'lista_5', (product_id,))
+    except Exception as error:
+        print(f"Erro ao executar a consulta: {error}")
+        return None
 
+def listar_mais_vendidos(config) -> List[Tuple[str, int, str]]:
+    # Consulta SQL para listar os 10 produtos mais vendidos por grupo
+    try:
+        return consultar(config, 'listar_mais_vendidos')
     except Exception as e:
         print(f"Erro ao executar a consulta: {e}")
         return []
     
 def listar_similares_maiores_vendas(product_id,config) -> List[Tuple[str, int]]:
     # Consulta SQL para listar produtos similares com melhores vendas
-    query = """
-    SELECT psimilar.title, psimilar.salesrank
-    FROM produtos p
-    JOIN produtos_similares sp ON p.asin = sp.product_asin
-    JOIN produtos psimilar ON psimilar.asin = sp.similar_asin
-    WHERE p.product_id = %s
-    AND psimilar.salesrank < p.salesrank;
-    """
     try:
-        # Obter as configurações de conexão
-
-        # Conectar ao banco de dados
-        conn = psycopg2.connect(**config)
-        cur = conn.cursor()
-
-        # Executar a consulta
-        cur.execute(query, (product_id,))
-        result = cur.fetchall()
-
-        # Fechar a conexão
-        cur.close()
-        conn.close()
-
-        # Retornar o resultado
-        return result
+        return consultar(config, 'listar_similares_maiores_vendas', (product_id,))
     except Exception as e:
         print(f"Erro ao executar a consulta: {e}")
         return []
 
 def evolucao_medias_avaliacao(product_id, config):
     # Consulta SQL para calcular a média das avaliações por data
-    query = """
-    SELECT p.title, r.review_date, round(avg(r.rating), 2)
-    FROM produtos p
-    INNER JOIN avaliacoes r ON p.product_id = r.product_id
-    WHERE p.product_id = %s
-    GROUP BY p.title, r.review_date
-    ORDER BY r.review_date ASC;
-    """
-    
     try:
-        # Conectar ao banco de dados
-        conn = psycopg2.connect(**config)
-        cur = conn.cursor()
-
-        # Executar a consulta
-        cur.execute(query, (product_id,))
-        result = cur.fetchall()
-
-        # Fechar a conexão
-        cur.close()
-        conn.close()
+        result = consultar(config, 'evolucao_medias_avaliacao', (product_id,))
 
         # Exibir o resultado
         for row in result:
@@ -142,123 +492,138 @@ def evolucao_medias_avaliacao(product_id, config):
 
 def listar_clientes(config) -> List[Tuple[str, int, int, str]]:
     # Consulta SQL para listar os 10 principais clientes
-    query = """
-        SELECT customer_id, n_reviews, review_rank, product_group
-        FROM (
-        SELECT customer_id, n_reviews, product_group,
-               ROW_NUMBER() OVER (PARTITION BY t1.product_group ORDER BY t1.n_reviews DESC) AS review_rank
-        FROM (
-            SELECT r.customer_id, COUNT(r.customer_id) AS n_reviews, p.product_group
-            FROM produtos p
-            INNER JOIN avaliacoes r ON p.product_id = r.product_id
-            GROUP BY p.product_group, r.customer_id
-        ) AS t1
-        ORDER BY t1.product_group ASC, t1.n_reviews DESC
-    ) AS t2
-    WHERE review_rank <= 10;
-    """
-
     try:
-        # Conectar ao banco de dados
-        conn = psycopg2.connect(**config)
-        cur = conn.cursor()
-
-        # Executar a consulta
-        cur.execute(query)
-        result = cur.fetchall()
-
-        # Fechar a conexão
-        cur.close()
-        conn.close()
-
-        # Retornar o resultado
-        return result
-
+        return consultar(config, 'listar_clientes')
     except Exception as e:
         print(f"Erro ao executar a consulta: {e}")
         return []
 
 def listar_categorias(config) -> List[Tuple[str, float]]:
     # Consulta SQL para listar as 5 principais categorias
-    query = """
-    SELECT c.name, ROUND(t_avg.avg, 2)
-    FROM categoria c
-    INNER JOIN (
-        SELECT pc.category_id, AVG(qtd_pos.count) AS avg
-        FROM produto_categoria pc
-        INNER JOIN (
-            SELECT r.product_id, COUNT(*) AS count
-            FROM avaliacoes r
-            WHERE r.helpful > 0
-            GROUP BY r.product_id
-        ) qtd_pos ON qtd_pos.product_id = pc.product_id
-        GROUP BY pc.category_id
-        HAVING AVG(qtd_pos.count) > 0
-        ORDER BY avg DESC
-        LIMIT 5
-    ) t_avg ON c.category_id = t_avg.category_id;
-    """
-    
     try:
-        # Conectar ao banco de dados
-        conn = psycopg2.connect(**config)
-        cur = conn.cursor()
-
-        # Executar a consulta
-        cur.execute(query)
-        result = cur.fetchall()
-
-        # Fechar a conexão
-        cur.close()
-        conn.close()
+        return consultar(config, 'listar_categorias')
+    except Exception as e:
+        print(f"Erro ao executar a consulta: {e}")
+        return []
 
-        # Retornar o resultado
-        return result
+def listar_produtos(config) -> List[Tuple[int, str, str, float, int]]:
+    # Consulta SQL para listar os produtos
+    try:
+        return consultar(config, 'listar_produtos')
+    except Exception as e:
+        print(f"Erro ao executar a consulta: {e}")
+        return []
 
+def subarvore_categoria(category_id, config) -> List[Tuple[int, str, int, int]]:
+    # Consulta SQL recursiva para listar a categoria e todas as suas descendentes
+    try:
+        return consultar(config, 'subarvore_categoria', (category_id,))
     except Exception as e:
         print(f"Erro ao executar a consulta: {e}")
         return []
 
-def listar_produtos() -> List[Tuple[int, str, str, float, int]]:
-    # Consulta SQL para listar os produtos
-    query = """
-    SELECT t2.product_id, t2.title, t2.product_group, t2.avg_helpful, t2.n_rank
-    FROM (
-        SELECT p.product_id, p.title, p.product_group, t1.avg_helpful, 
-               ROW_NUMBER() OVER (PARTITION BY p.product_group ORDER BY t1.avg_helpful DESC) AS n_rank
-        FROM produtos p
-        JOIN (
-            SELECT r.product_id, ROUND(AVG(r.helpful), 2) AS avg_helpful
-            FROM avaliacoes r
-            WHERE r.helpful > 0
-            GROUP BY r.product_id
-        ) t1 ON t1.product_id = p.product_id
-    ) AS t2
-    WHERE t2.n_rank <= 10;
-    """
-    
+def ancestrais_categoria(category_id, config) -> List[Tuple[int, str, int]]:
+    # Consulta SQL recursiva para listar o caminho da raiz até a categoria
     try:
-        # Conectar ao banco de dados
-        conn = psycopg2.connect(**config)
-        cur = conn.cursor()
+        return consultar(config, 'ancestrais_categoria', (category_id,))
+    except Exception as e:
+        print(f"Erro ao executar a consulta: {e}")
+        return []
 
-        # Executar a consulta
-        cur.execute(query)
-        result = cur.fetchall()
+def navegar_relatorio(nome, config, formatar, tamanho=TAMANHO_PAGINA):
+    # Mostra o relatório página a página: Enter mostra a próxima, q sai
+    depois = None
+    try:
+        while True:
+            linhas, depois = pagina_relatorio(config, nome, depois, tamanho)
+            for linha in linhas:
+                print(formatar(linha))
+            if depois is None or input("Enter para a próxima página, q para sair:").strip().lower() == "q":
+                break
+    except Exception as e:
+        print(f"Erro ao executar a consulta: {e}")
 
-        # Fechar a conexão
-        cur.close()
-        conn.close()
+def lista_5_lote(product_ids, config) -> Iterable[Tuple[int, List[Tuple]]]:
+    # Os comentários da opção a para vários produtos numa consulta só, agrupados por produto
+    try:
+        yield from consultar_por_produto(config, 'lista_5_lote', product_ids)
+    except Exception as e:
+        print(f"Erro ao executar a consulta: {e}")
 
-        # Retornar o resultado
-        return result
+def listar_similares_maiores_vendas_lote(product_ids, config) -> Iterable[Tuple[int, List[Tuple[str, int]]]]:
+    # Os similares com melhores vendas (opção b) de vários produtos, agrupados por produto
+    try:
+        yield from consultar_por_produto(config, 'listar_similares_maiores_vendas_lote', product_ids)
+    except Exception as e:
+        print(f"Erro ao executar a consulta: {e}")
 
+def evolucao_medias_avaliacao_lote(product_ids, config) -> Iterable[Tuple[int, List[Tuple]]]:
+    # A média diária das avaliações (opção c) de vários produtos, agrupada por produto
+    try:
+        yield from consultar_por_produto(config, 'evolucao_medias_avaliacao_lote', product_ids)
     except Exception as e:
         print(f"Erro ao executar a consulta: {e}")
-        return []
     
 
 
+# Exportação dos relatórios pela linha de comando: extensão do arquivo e opções do COPY
+FORMATOS = {
+    'csv': ("csv", "(FORMAT csv, HEADER)"),
+    'binario': ("pgcopy", "(FORMAT binary)"),
+}
+RELATORIOS_EXPORTAVEIS = "abcdefg"
+
+
+def exportar_relatorio(config, letra, ids, formato, pasta):
+    # Exporta o relatório da opção letra com COPY (consulta) TO STDOUT direto para o arquivo,
+    # sem passar as linhas pelo Python; a, b e c usam as versões em lote com a lista de ids.
+    # Devolve o arquivo, o número de linhas e os segundos gastos
+    nome = OPCOES[letra]
+    params = None
+    if CONSULTAS[nome][0]:
+        nome = f"{nome}_lote"
+        params = {'p1': list(ids)}
+    extensao, opcoes = FORMATOS[formato]
+    arquivo = os.path.join(pasta, f"{letra}_{OPCOES[letra]}.{extensao}")
+    # O COPY não aceita parâmetros, então os ids entram no texto da consulta pelo mogrify
+    query = notacao_psycopg((CONSULTAS_LOTE if params else CONSULTAS)[nome][1])
+
+    inicio = time.perf_counter()
+    with conexao(config) as conn:
+        with conn.cursor() as cur:
+            query = cur.mogrify(query, params).decode(psycopg2.extensions.encodings[conn.encoding])
+            # O arquivo só aparece com o nome final se o COPY terminar
+            temporario = f"{arquivo}.tmp"
+            try:
+                with open(temporario, "wb") as f:
+                    cur.copy_expert(f"COPY ({query}) TO STDOUT WITH {opcoes}", f)
+            except BaseException:
+                os.remove(temporario)
+                raise
+            os.replace(temporario, arquivo)
+            return arquivo, cur.rowcount, time.perf_counter() - inicio
+
+
+def executar_relatorios(config, letras, ids, formato, pasta, paralelos=TAMANHO_POOL):
+    # Exporta os relatórios ao mesmo tempo, até paralelos por vez (no máximo o tamanho do
+    # pool), e mostra o tempo de cada um; devolve quantos falharam
+    os.makedirs(pasta, exist_ok=True)
+    inicio = time.perf_counter()
+    falhas = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(paralelos, TAMANHO_POOL))) as executor:
+        futuros = {executor.submit(exportar_relatorio, config, letra, ids, formato, pasta): letra for letra in letras}
+        for futuro in concurrent.futures.as_completed(futuros):
+            letra = futuros[futuro]
+            try:
+                arquivo, linhas, segundos = futuro.result()
+                print(f"Relatório {letra} ({OPCOES[letra]}): {linhas} linhas em {segundos:.2f} segundos -> {arquivo}")
+            except Exception as e:
+                falhas += 1
+                print(f"Erro no relatório {letra} ({OPCOES[letra]}): {e}")
+    print(f"{len(letras) - falhas} de {len(letras)} relatórios exportados em {time.perf_counter() - inicio:.2f} segundos.")
+    return falhas
+
+
 config = {
             'dbname': 'xxxxx',
             'user': 'xxxxx',
@@ -268,72 +633,130 @@ config = {
         }
 
 
-print("Selecione as seguintes opções:\na)para listar os comentários mais úteis e com maior avaliação e os 5 comentários mais úteis e com menor avaliação\nb)listar os produtos similares com maiores vendas que ele\nc)Para mostrar a evolução diária das médias de avaliação ao longo do intervalo de tempo\nd)Para listar os 10 produtos lideres de venda em cada grupo de produtos\ne)Para listar os 10 produtos com a maior média de avaliações úteis positivas por produto\nf)Para listar 5 categorias de produtos com maior média de avaliações úteis positivas por produto\ng)Para listar os 10 clientes que mais fizeram comentários por grupo de produto ")
-escolha = (input(("Digite uma letra:")))
-
-if escolha == "d":
-    x = listar_mais_vendidos(config)
-
-    print(f"{'Title'.ljust(60)} {'Salesrank'.ljust(10)} {'Product Group'}")
-    print("="*80)
-
-    # Itera sobre os dados e exibe-os formatados
-    for item in x:
-        title = item[0].ljust(60)  # Ajusta a largura da coluna 'Title'
-        salesrank = str(item[1]).ljust(10)  # Ajusta a largura da coluna 'Salesrank'
-        product_group = item[2]  # 'Product Group' não precisa de ajuste
-        print(f"{title} {salesrank} {product_group}")
-elif escolha == "a":
-    aux = int(input(("Digite o ID:")))
-    x = lista_5(aux,config)
-    # Cabeçalhos da tabela
-    # Cabeçalhos da tabela
-    print(f"{'Product ID':<10} {'ASIN':<12} {'Customer ID':<20} {'Review Date':<15} {'Rating':<6}    {'Helpful':<15}")
-    print("=" * 80)
-
-    # Exibindo os dados de forma organizada
-    for row in x:
-        product_id, asin, customer_id, review_date, rating, helpful = row  
-        print(f"{product_id:<10} {asin:<12} {customer_id:<20} {review_date}           {rating:<6} {helpful:<15}")
-
-elif escolha == "b":
-    aux = input(("Digite o ID:"))
-    x = listar_similares_maiores_vendas(aux,config)
-    print(f"{'Title':<50} {'Salesrank':<10}")
-    print("=" * 75)
-
-    for row in x:
-        title, salesrank = row
-        print(f"{title:<50} {salesrank:<10}")
-    
-elif escolha == "c":
-    aux = int(input(("Digite o ID:")))
-    evolucao_medias_avaliacao(aux,config)
-
-elif escolha == "g":
-    x = listar_clientes(config)
-    print(f"{'Cliente':<15} {'Sales':<6} {'Rank':<5} {'Type':<10}")
-    print("=" * 40)
-
-    # Impressão dos dados
-    for item in x:
-        cliente, sales, rank, type_ = item
-        print(f"{cliente:<15} {sales:<6} {rank:<5} {type_:<10}")
-
-elif escolha == "f":
-    x = listar_categorias(config)
-    print(f"{'Categoria':<20} {'Média':<10}")
-    print("=" * 30)
-
-    # Impressão dos dados
-    for categoria, media in x:
-        print(f"{categoria:<20} {media:<10}")
-
-elif escolha == "e":
-    x = listar_produtos()
-    print(f"{'ID':<5} {'Título':<100} {'Grupo':<10} {'Média Helpful':<15} {'Rank':<5}")
-    print("=" * 130)
-
-    # Impressão dos dados
-    for product_id, title, group, media_helpful, rank in x:
-        print(f"{product_id:<5} {title:<100} {group:<10} {media_helpful:<15} {rank:<5}")
\ No newline at end of file
+if __name__ == "__main__":
+    # Sem argumentos abre o menu; com --relatorios exporta os relatórios sem interação
+    parser = argparse.ArgumentParser(description="Dashboard das consultas da Amazon")
+    parser.add_argument("--relatorios", nargs="+", choices=list(RELATORIOS_EXPORTAVEIS) + ["all"],
+                        help="relatórios a exportar (letras do menu, ou all para todos)")
+    parser.add_argument("--ids", nargs="+", type=int, default=[],
+                        help="ids dos produtos dos relatórios a, b e c")
+    parser.add_argument("--ids-arquivo", help="arquivo com um id de produto por linha (somado a --ids)")
+    parser.add_argument("--formato", choices=list(FORMATOS), default="csv",
+                        help="csv com cabeçalho ou o formato binário do COPY do PostgreSQL")
+    parser.add_argument("--saida", default="relatorios", help="pasta dos arquivos exportados")
+    parser.add_argument("--paralelos", type=int, default=TAMANHO_POOL,
+                        help=f"relatórios exportados ao mesmo tempo (até {TAMANHO_POOL})")
+    args = parser.parse_args()
+
+    if args.relatorios:
+        letras = RELATORIOS_EXPORTAVEIS if "all" in args.relatorios else "".join(dict.fromkeys(args.relatorios))
+        ids = list(args.ids)
+        if args.ids_arquivo:
+            with open(args.ids_arquivo, "r", encoding="utf8") as f:
+                ids.extend(int(linha) for linha in f if linha.strip())
+        if not ids and any(CONSULTAS[OPCOES[letra]][0] for letra in letras):
+            parser.error("os relatórios a, b e c precisam de --ids ou --ids-arquivo")
+        sys.exit(1 if executar_relatorios(config, letras, ids, args.formato, args.saida, args.paralelos) else 0)
+
+    print("Selecione as seguintes opções:\na)para listar os comentários mais úteis e com maior avaliação e os 5 comentários mais úteis e com menor avaliação\nb)listar os produtos similares com maiores vendas que ele\nc)Para mostrar a evolução diária das médias de avaliação ao longo do intervalo de tempo\nd)Para listar os 10 produtos lideres de venda em cada grupo de produtos\ne)Para listar os 10 produtos com a maior média de avaliações úteis positivas por produto\nf)Para listar 5 categorias de produtos com maior média de avaliações úteis positivas por produto\ng)Para listar os 10 clientes que mais fizeram comentários por grupo de produto\nh)Para listar a subárvore de uma categoria\ni)Para listar os ancestrais de uma categoria\nj)Para navegar pela evolução diária das médias de todos os produtos\nk)Para navegar pelo ranking completo de clientes por grupo ")
+    escolha = (input(("Digite uma letra:")))
+
+    if escolha == "d":
+        x = listar_mais_vendidos(config)
+
+        print(f"{'Title'.ljust(60)} {'Salesrank'.ljust(10)} {'Product Group'}")
+        print("="*80)
+
+        # Itera sobre os dados e exibe-os formatados
+        for item in x:
+            title = item[0].ljust(60)  # Ajusta a largura da coluna 'Title'
+            salesrank = str(item[1]).ljust(10)  # Ajusta a largura da coluna 'Salesrank'
+            product_group = item[2]  # 'Product Group' não precisa de ajuste
+            print(f"{title} {salesrank} {product_group}")
+    elif escolha == "a":
+        aux = int(input(("Digite o ID:")))
+        x = lista_5(aux,config)
+        # Cabeçalhos da tabela
+        # Cabeçalhos da tabela
+        print(f"{'Product ID':<10} {'ASIN':<12} {'Customer ID':<20} {'Review Date':<15} {'Rating':<6}    {'Helpful':<15}")
+        print("=" * 80)
+
+        # Exibindo os dados de forma organizada
+        for row in x:
+            product_id, asin, customer_id, review_date, rating, helpful = row  
+            print(f"{product_id:<10} {asin:<12} {customer_id:<20} {review_date}           {rating:<6} {helpful:<15}")
+
+    elif escolha == "b":
+        aux = input(("Digite o ID:"))
+        x = listar_similares_maiores_vendas(aux,config)
+        print(f"{'Title':<50} {'Salesrank':<10}")
+        print("=" * 75)
+
+        for row in x:
+            title, salesrank = row
+            print(f"{title:<50} {salesrank:<10}")
+        
+    elif escolha == "c":
+        aux = int(input(("Digite o ID:")))
+        evolucao_medias_avaliacao(aux,config)
+
+    elif escolha == "g":
+        x = listar_clientes(config)
+        print(f"{'Cliente':<15} {'Sales':<6} {'Rank':<5} {'Type':<10}")
+        print("=" * 40)
+
+        # Impressão dos dados
+        for item in x:
+            cliente, sales, rank, type_ = item
+            print(f"{cliente:<15} {sales:<6} {rank:<5} {type_:<10}")
+
+    elif escolha == "f":
+        x = listar_categorias(config)
+        print(f"{'Categoria':<20} {'Média':<10}")
+        print("=" * 30)
+
+        # Impressão dos dados
+        for categoria, media in x:
+            print(f"{categoria:<20} {media:<10}")
+
+    elif escolha == "e":
+        x = listar_produtos(config)
+        print(f"{'ID':<5} {'Título':<100} {'Grupo':<10} {'Média Helpful':<15} {'Rank':<5}")
+        print("=" * 130)
+
+        # Impressão dos dados
+        for product_id, title, group, media_helpful, rank in x:
+            print(f"{product_id:<5} {title:<100} {group:<10} {media_helpful:<15} {rank:<5}")
+
+    elif escolha == "h":
+        aux = int(input(("Digite o ID da categoria:")))
+        x = subarvore_categoria(aux, config)
+        print(f"{'ID':<10} {'Categoria':<50} {'Pai':<10} {'Nível':<5}")
+        print("=" * 78)
+
+        # Indenta cada categoria conforme o nível na árvore
+        for category_id, name, parent_id, nivel in x:
+            print(f"{category_id:<10} {('  ' * nivel + name):<50} {str(parent_id):<10} {nivel:<5}")
+
+    elif escolha == "i":
+        aux = int(input(("Digite o ID da categoria:")))
+        x = ancestrais_categoria(aux, config)
+        # Caminho da raiz até a categoria, no mesmo formato do arquivo de entrada
+        print("|" + "|".join(f"{name}[{category_id}]" for category_id, name, _ in x))
+
+    elif escolha == "j":
+        print(f"{'ID':<10} {'Título':<50} {'Data':<12} {'Média':<6}")
+        print("=" * 80)
+        navegar_relatorio('evolucao_medias_avaliacao', config,
+                          lambda row: f"{row[0]:<10} {(row[1] or '')[:50]:<50} {str(row[2]):<12} {row[3]:<6}")
+
+    elif escolha == "k":
+        print(f"{'Cliente':<15} {'Sales':<6} {'Rank':<5} {'Type':<10}")
+        print("=" * 40)
+        navegar_relatorio('listar_clientes', config,
+                          lambda row: f"{row[0]:<15} {row[1]:<6} {row[2]:<5} {row[3]:<10}")
+
+    relatorio = cache.relatorio()
+    if relatorio['acertos'] or relatorio['falhas']:
+        print(f"\nCache de consultas: {relatorio['acertos']} acertos, {relatorio['falhas']} falhas "
+              f"({relatorio['taxa_acerto']:.0%}), {relatorio['economizado_s'] * 1000:.1f} ms economizados.")